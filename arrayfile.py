@@ -0,0 +1,79 @@
+"""
+A small binary container for named numpy arrays plus some JSON metadata, which can be memory mapped.
+
+Layout:
+    8 bytes     magic
+    8 bytes     little-endian length of the JSON header
+    header      {"meta": ..., "arrays": {name: {"dtype", "shape", "offset"}}}
+    arrays      raw C-order bytes, each starting at a multiple of 64 bytes from the start of the file
+
+np.savez can't be memory mapped, and pickle copies everything into each process, hence this.
+"""
+import json
+import os
+
+import numpy as np
+
+MAGIC = b"A1ARRAY1"
+ALIGN = 64
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def save(path, arrays, meta=None):
+    """
+    Write a {name: array} dict and a JSON-able meta to path.
+
+    We write to a temporary file and rename it over path, so a reader (say another sweep worker) never sees half a file.
+    """
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, a in arrays.items():
+        layout[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset}
+        offset = _aligned(offset + a.nbytes)
+    header = json.dumps({"meta": meta, "arrays": layout}).encode()
+    start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, a in arrays.items():
+            f.seek(start + layout[name]["offset"])
+            f.write(a.tobytes())
+        # Pad the end so the last array is whole even if it was empty
+        f.truncate(start + offset)
+    os.replace(tmp, path)
+
+
+def load(path, mmap=True):
+    """
+    Read what save() wrote, as ({name: array}, meta).
+
+    With mmap the arrays are read-only views onto a memory map of the file, so nothing is read until used
+        and processes loading the same file share its pages. Otherwise they are read-only views onto its bytes.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an array file")
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len))
+        if not mmap:
+            f.seek(0)
+            data = np.frombuffer(f.read(), dtype=np.uint8)
+    start = _aligned(len(MAGIC) + 8 + header_len)
+    if mmap:
+        # Plain ndarray views keep the map open, without memmap's subclass overhead on every operation
+        data = np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray)
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        a = start + spec["offset"]
+        arrays[name] = data[a:a + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+    return arrays, header["meta"]
@@ -0,0 +1,196 @@
+"""
+Many independent nematode brains, stepped together.
+
+Each worm is a row of an (n_worms, n_neurons) state matrix, and all of them share one CompiledConnectome,
+    so a timestep for the whole batch is one thresholded mask and one matmul, however many worms there are.
+
+Batches can also be forked off one state (see Nematode.fork), copy-on-write: the worms start out as read-only views
+    of that one state, and worms given their own weights with set_weights get their own connectome,
+    shared by every worm given the same weights at once, while the rest keep sharing the original.
+"""
+import numpy as np
+
+from engine import CompiledConnectome, MotorReadout
+from hooks import Hooks
+
+
+class NematodeBatch:
+    """
+    The brains of n_worms Nematodes (with the csr engine), as arrays.
+
+    Row i of curr and next is worm i's curr and next, and stays identical to what a Nematode given
+        the same threshold and stimulus would have. threshold may be a scalar or one per worm.
+
+    Stimulus is applied per worm: every trigger takes a worms selector (boolean mask or index array, None for all),
+        so each worm can follow its own schedule.
+
+    Given curr and next vectors, every worm starts from them. They're broadcast, not copied,
+        until the first stimulus or step writes to the state.
+    """
+    def __init__(self, n_worms, threshold=30, compiled=None, curr=None, next=None, timestep=0):
+        self.compiled = compiled if compiled is not None else CompiledConnectome.from_file()
+        self.n_worms = n_worms
+
+        n = self.compiled.n
+        shape = (n_worms, n)
+        self.curr = np.zeros(shape, dtype=np.int64) if curr is None else np.broadcast_to(curr, shape)
+        self.next = np.zeros(shape, dtype=np.int64) if next is None else np.broadcast_to(next, shape)
+        self.threshold = np.zeros(n_worms, dtype=np.float64)
+        self.threshold[:] = threshold
+
+        self.index = self.compiled.index
+        self.readout = MotorReadout(self.index)
+        self.food_stimulus = self.compiled.stimulus(self.index.food_sensors)
+        self.nose_touch_stimulus = self.compiled.stimulus(self.index.nose_touch_sensors)
+
+        # Left and right motor totals from the last step, one per worm
+        self.accumleft = np.zeros(n_worms, dtype=np.int64)
+        self.accumright = np.zeros(n_worms, dtype=np.int64)
+
+        # Connectome of each worm, as an index into connectomes. 0 is self.compiled.
+        self.connectomes = [self.compiled]
+        self.variant = np.zeros(n_worms, dtype=np.int64)
+        # Sensor group stimulus vectors, by (connectome, group)
+        self._stimuli = {(0, "food_sensors"): self.food_stimulus, (0, "nose_touch_sensors"): self.nose_touch_stimulus}
+
+        self.timestep = timestep
+
+        # Wrappers of our methods for profiling, see hooks.py
+        self.hooks = Hooks()
+
+    def _own_state(self):
+        """Copy the shared initial state, if we still have it, before writing to it."""
+        if not self.curr.flags.writeable:
+            self.curr = self.curr.copy()
+        if not self.next.flags.writeable:
+            self.next = self.next.copy()
+
+    def _select(self, worms):
+        """A worms selector as an array of worm indices"""
+        return np.arange(self.n_worms)[worms if worms is not None else slice(None)]
+
+    def set_weights(self, src, dst, w, worms=None):
+        """
+        Give the selected worms their own connectome, with the weight from each src[i] to dst[i] neuron id
+            set to w[i] (see CompiledConnectome.with_weights). Other worms keep theirs.
+        Worms sharing a connectome before share the new one after, so this costs one copy
+            of the connectome per distinct connectome changed, not per worm.
+        """
+        worms = self._select(worms)
+        for v in np.unique(self.variant[worms]).tolist():
+            members = worms[self.variant[worms] == v]
+            self.connectomes.append(self.connectomes[v].with_weights(src, dst, w))
+            self.variant[members] = len(self.connectomes) - 1
+
+        # Drop connectomes no worm uses anymore, except the original
+        used = set(self.variant.tolist())
+        for v in range(1, len(self.connectomes)):
+            if v not in used:
+                self.connectomes[v] = None
+        self._stimuli = {key: s for key, s in self._stimuli.items() if key[0] == 0 or key[0] in used}
+
+    def _propagated(self, fired):
+        """Each worm's fired row times its connectome's dense inputs (see CompiledConnectome.dense_inputs)."""
+        if len(self.connectomes) == 1:
+            dense = self.compiled.dense_inputs()
+            return (fired.astype(dense.dtype) @ dense).astype(np.int64)
+
+        y = np.empty((self.n_worms, 2 * self.compiled.n), dtype=np.int64)
+        for v, connectome in enumerate(self.connectomes):
+            if connectome is None:
+                continue
+            worms = np.flatnonzero(self.variant == v)
+            if worms.size:
+                dense = connectome.dense_inputs()
+                y[worms] = fired[worms].astype(dense.dtype) @ dense
+        return y
+
+    def stimulate(self, stimulus, worms=None):
+        """Add a stimulus vector (see CompiledConnectome.stimulus) onto next for the selected worms."""
+        self._own_state()
+        if worms is None:
+            self.next += stimulus
+        else:
+            self.next[worms] += stimulus
+
+    def trigger_sensors(self, group, worms=None):
+        """
+        Stimulate the selected worms with a sensor group of the index, e.g. "food_sensors",
+            through each one's own connectome.
+        """
+        if len(self.connectomes) == 1:
+            self.stimulate(self._stimulus(0, group), worms)
+            return
+        selected = np.zeros(self.n_worms, dtype=bool)
+        selected[self._select(worms)] = True
+        for v in np.unique(self.variant[selected]).tolist():
+            self.stimulate(self._stimulus(v, group), selected & (self.variant == v))
+
+    def _stimulus(self, v, group):
+        if (v, group) not in self._stimuli:
+            self._stimuli[v, group] = self.connectomes[v].stimulus(getattr(self.index, group))
+        return self._stimuli[v, group]
+
+    def trigger_food_sensors(self, worms=None):
+        self.trigger_sensors("food_sensors", worms)
+
+    def trigger_nose_touch_sensors(self, worms=None):
+        self.trigger_sensors("nose_touch_sensors", worms)
+
+    def step(self):
+        """
+        Step every worm one timestep forward, as Nematode.propagate_connectome does for one.
+
+        :return: (left, right) arrays of each worm's accumulated left and right muscle values.
+        """
+        self._own_state()
+        c = self.compiled
+        fired = c.can_fire & (np.abs(self.curr) > self.threshold[:, None])
+        y = self._propagated(fired)
+        np.add(self.next, y[:, :c.n], out=self.next)
+        np.copyto(self.next, y[:, c.n:], where=fired)
+
+        self.accumleft, self.accumright = self.readout.read(self.next)
+
+        np.copyto(self.curr, self.next)
+        self.timestep += 1
+        return self.accumleft, self.accumright
+
+    def start_profile(self):
+        """
+        Count firings and stimulations per neuron over every worm from now on, in a profiler.ActivityProfiler,
+            until stop_profile(), as Nematode.start_profile does.
+        Synapse additions are counted against the original connectome's edges, whatever set_weights did.
+
+        :return: the ActivityProfiler
+        """
+        from profiler import ActivityProfiler
+        if getattr(self, "profiler", None) is not None:
+            self.stop_profile()
+        profiler = self.profiler = ActivityProfiler(self.compiled)
+        can_fire = self.compiled.can_fire
+
+        def profiled_step(step):
+            def step_profiled():
+                profiler.record_fired(can_fire & (np.abs(self.curr) > self.threshold[:, None]))
+                return step()
+            return step_profiled
+
+        def profiled_trigger(trigger_sensors):
+            def trigger_sensors_profiled(group, worms=None):
+                profiler.record_stimulus(getattr(self.index, group), len(self._select(worms)))
+                trigger_sensors(group, worms)
+            return trigger_sensors_profiled
+
+        self.hooks.add("profile", self, "step", profiled_step)
+        self.hooks.add("profile", self, "trigger_sensors", profiled_trigger)
+        return profiler
+
+    def stop_profile(self):
+        """Take the profiling wrappers off. :return: the ActivityProfiler, or None if we weren't profiling"""
+        profiler = getattr(self, "profiler", None)
+        if profiler is None:
+            return None
+        self.profiler = None
+        self.hooks.remove("profile")
+        return profiler
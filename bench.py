@@ -0,0 +1,517 @@
+"""
+Benchmarks of the hot paths: the connectome engines, motorcontrol, body movement and sensing,
+    the batched brains and bodies, CTRNN.advance and CartPole.step.
+
+    python bench.py [--quick] [--only NAME ...] [--json PATH] [--turtle] [--history [PATH]]
+    python bench.py compare [BASELINE [CANDIDATE]] [--history PATH] [--slowdown 0.05] [--alpha 0.01]
+
+Each benchmark times every call on its own, and reports steps/sec along with per-call latency percentiles,
+    as one JSON document (to stdout, or --json PATH), with a line per result on stderr as it goes.
+A "step" is one timestep of one worm or body, so batched benchmarks count n of them per call.
+
+Everything runs headless, on kinematics.HeadlessBody, except the turtle body.Body benchmarks with --turtle,
+    which need a display. CTRNN.advance needs neat installed, and is reported as skipped without it.
+
+With --history, each result is also appended as a line to a JSON lines history file (HISTORY by default),
+    keyed by commit, machine and benchmark (name and params, e.g. the engine).
+compare then checks every benchmark run at both the baseline and candidate commits on this machine,
+    and flags those where the candidate is slower by more than --slowdown, with a one-sided Welch's t-test
+    on the per-call latencies significant at --alpha. It exits with 1 if any are, so it can gate a merge.
+    Repeated runs of a commit are pooled. By default the candidate is the last commit in the history and
+    the baseline the one before it.
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Synthetic connectomes are this many times the size of ours, see scaled_connectome()
+SCALES = (1, 4, 16)
+BATCH_SIZES = (1, 16, 256, 1024)
+CTRNN_SIZES = (10, 100, 1000)
+
+BENCHMARKS = {}
+
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_history.jsonl")
+
+
+def benchmark(name):
+    """Register a benchmark, a function taking the number of calls to time and yielding results."""
+    def register(f):
+        BENCHMARKS[name] = f
+        return f
+    return register
+
+
+def result(name, params, latencies, steps=1):
+    """
+    A JSON-able result, from the nanoseconds each call took and how many steps each call was.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    us = latencies / 1e3
+    p50, p90, p99 = np.percentile(us, [50, 90, 99])
+    return {
+        "name": name,
+        "params": params,
+        "calls": len(latencies),
+        "steps_per_sec": steps * len(latencies) / (latencies.sum() / 1e9),
+        "latency_us": {"mean": us.mean(), "std": us.std(ddof=1) if len(us) > 1 else 0.0,
+                       "p50": p50, "p90": p90, "p99": p99, "max": us.max()},
+    }
+
+
+def timed(f, calls, warmup, before=None):
+    """
+    Call f calls times (after warmup untimed calls) and return how long each call took, in ns.
+    before(), if given, is called untimed ahead of every call, e.g. to apply stimulus.
+    """
+    clock = time.perf_counter_ns
+    latencies = np.zeros(calls, dtype=np.int64)
+    for i in range(-warmup, calls):
+        if before is not None:
+            before()
+        start = clock()
+        f()
+        end = clock()
+        if i >= 0:
+            latencies[i] = end - start
+    return latencies
+
+
+def sense(nematode):
+    """What Nematode.main does ahead of propagating, minus the drawing."""
+    body = nematode.body
+    if body.nose_touching():
+        nematode.trigger_nose_touch_sensors()
+    elif nematode.environment.food_sensed(body, nematode.timestep):
+        nematode.trigger_food_sensors()
+    nematode.timestep += 1
+
+
+def nematode(engine):
+    import connectome
+    from kinematics import HeadlessBody
+    return connectome.Nematode(engine=engine, body=HeadlessBody())
+
+
+@benchmark("nematode.propagate_connectome")
+def bench_propagate(calls):
+    import connectome
+    for engine in connectome.ENGINES:
+        n = nematode(engine)
+        yield result("nematode.propagate_connectome", {"engine": engine},
+                     timed(n.propagate_connectome, calls, calls // 10, lambda: sense(n)))
+
+
+@benchmark("nematode.motorcontrol")
+def bench_motorcontrol(calls):
+    import connectome
+    for engine in connectome.ENGINES:
+        n = nematode(engine)
+        # Time motorcontrol where it's called, within propagate_connectome
+        latencies = []
+        motorcontrol = n.motorcontrol
+
+        def motorcontrol_timed():
+            start = time.perf_counter_ns()
+            motorcontrol()
+            latencies.append(time.perf_counter_ns() - start)
+
+        n.motorcontrol = motorcontrol_timed
+        timed(n.propagate_connectome, calls, calls // 10, lambda: sense(n))
+        yield result("nematode.motorcontrol", {"engine": engine}, latencies[-calls:])
+
+
+def scaled_connectome(scale, seed=0):
+    """
+    A random CompiledConnectome scale times the size of ours, with the same neurons (so the same muscles
+        and sensors) plus made up ones, and the same number of edges per neuron and spread of weights.
+    """
+    from engine import CompiledConnectome
+    from neurons import NeuronIndex
+
+    ours = CompiledConnectome.load()
+    if scale == 1:
+        return ours
+    rng = np.random.default_rng(seed)
+    index = NeuronIndex(ours.index.names + [f"X{i}" for i in range((scale - 1) * ours.n)])
+    n_edges = len(ours.src) * scale
+    # Muscles only receive
+    cells = np.flatnonzero(~index.muscle)
+    src = cells[rng.integers(0, len(cells), n_edges)]
+    dst = rng.integers(0, len(index), n_edges)
+    w = rng.choice(ours.w, n_edges)
+    return CompiledConnectome(index, src, dst, w)
+
+
+@benchmark("engine.propagate")
+def bench_engine(calls):
+    from engine import FusedConnectome
+    for scale in SCALES:
+        compiled = scaled_connectome(scale)
+        for name, c in (("csr", compiled), ("fused", FusedConnectome(compiled))):
+            curr, next = c.zeros(), c.zeros()
+            food = c.stimulus(compiled.index.food_sensors)
+            touch = c.stimulus(compiled.index.nose_touch_sensors)
+            step = [0]
+
+            def stimulate():
+                # Food to get going, then nose touch every so often to keep it going
+                step[0] += 1
+                if step[0] < 15:
+                    np.add(next, food, out=next)
+                elif step[0] % 20 == 0:
+                    np.add(next, touch, out=next)
+
+            def propagate():
+                c.propagate(curr, next, 30)
+                np.copyto(curr, next)
+
+            yield result("engine.propagate", {"engine": name, "neurons": compiled.n, "edges": len(compiled.src)},
+                         timed(propagate, calls, calls // 10, stimulate))
+
+
+@benchmark("batch.step")
+def bench_batch(calls):
+    from batch import NematodeBatch
+    from engine import CompiledConnectome
+    compiled = CompiledConnectome.load()
+    for n_worms in BATCH_SIZES:
+        brains = NematodeBatch(n_worms, compiled=compiled)
+        rng = np.random.default_rng(0)
+
+        def stimulate():
+            if brains.timestep < 15:
+                brains.trigger_food_sensors()
+            else:
+                brains.trigger_nose_touch_sensors(rng.random(n_worms) < 0.05)
+
+        # Fewer calls for the big batches, they take a while each
+        n_calls = max(calls * 16 // max(n_worms, 16), 20)
+        yield result("batch.step", {"worms": n_worms},
+                     timed(brains.step, n_calls, n_calls // 10, stimulate), steps=n_worms)
+
+
+def motor_values(n, seed=0):
+    """Left and right values like motorcontrol sends, roughly"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(-40, 60, n).tolist(), rng.integers(-40, 60, n).tolist()
+
+
+@benchmark("body")
+def bench_body(calls):
+    from kinematics import HeadlessBody, BodyBatch
+    moves = list(zip(*motor_values(calls + calls // 10)))
+    body = HeadlessBody()
+    it = iter(moves)
+    yield result("body.move", {"body": "headless"}, timed(lambda: body.move(*next(it)), calls, calls // 10))
+    it = iter(moves)
+    yield result("body.nose_touching", {"body": "headless"},
+                 timed(body.nose_touching, calls, calls // 10, lambda: body.move(*next(it))))
+
+    for n in BATCH_SIZES:
+        bodies = BodyBatch(n)
+        rng = np.random.default_rng(0)
+        lefts, rights = rng.integers(-40, 60, (2, n))
+        yield result("body.move", {"body": "batch", "bodies": n},
+                     timed(lambda: bodies.move(lefts, rights), calls, calls // 10), steps=n)
+        yield result("body.nose_touching", {"body": "batch", "bodies": n},
+                     timed(bodies.nose_touching, calls, calls // 10), steps=n)
+
+
+def bench_turtle(calls):
+    from body import Body
+    body = Body()
+    moves = list(zip(*motor_values(calls + calls // 10)))
+    it = iter(moves)
+    yield result("body.move", {"body": "turtle"}, timed(lambda: body.move(*next(it)), calls, calls // 10))
+    yield result("body.nose_touching", {"body": "turtle"}, timed(body.nose_touching, calls, calls // 10))
+
+
+def ctrnn_network(size, seed=0):
+    """A random fully recurrent CTRNN of size nodes, 4 inputs in and the first node out, like the cart pole's."""
+    from ctrnn_derivations import CTRNN, CTRNNNodeEval
+    rng = random.Random(seed)
+    inputs = [-1, -2, -3, -4]
+    fan_in = min(size, 20)
+    node_evals = {}
+    for node in range(size):
+        links = [(rng.choice(inputs + list(range(size))), rng.gauss(0, 1)) for _ in range(fan_in)]
+        node_evals[node] = CTRNNNodeEval(0.01, math.tanh, sum, rng.gauss(0, 1), 1.0, links)
+    return CTRNN(inputs, [0], node_evals)
+
+
+@benchmark("ctrnn.advance")
+def bench_ctrnn(calls):
+    try:
+        ctrnn_network(1)
+    except ImportError as e:
+        yield {"name": "ctrnn.advance", "params": {}, "skipped": f"{e}"}
+        return
+    for size in CTRNN_SIZES:
+        net = ctrnn_network(size)
+        inputs = [0.5, 0.5, 0.5, 0.5]
+        yield result("ctrnn.advance", {"nodes": size},
+                     timed(lambda: net.advance(inputs, 0.01, 0.01), calls, calls // 10))
+
+
+@benchmark("cart_pole.step")
+def bench_cart_pole(calls):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "neat-python"))
+    import cart_pole
+    sim = cart_pole.CartPole(x=0.0, theta=0.05, dx=0.0, dtheta=0.0)
+    forces = iter([10.0, -10.0] * (calls + calls // 10))
+    yield result("cart_pole.step", {}, timed(lambda: sim.step(next(forces)), calls, calls // 10))
+
+
+def git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def machine():
+    """Where and on what these numbers were taken"""
+    return {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git("rev-parse", "HEAD") or None,
+        # Uncommitted changes to tracked files, so the numbers aren't quite the commit's
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def run(names=None, calls=2000, turtle=False, log=sys.stderr):
+    """Run the named benchmarks (all by default), returning {"machine": ..., "results": [...]}"""
+    benchmarks = dict(BENCHMARKS)
+    if turtle:
+        benchmarks["turtle"] = bench_turtle
+    results = []
+    for name, f in benchmarks.items():
+        if names and not any(name.startswith(wanted) or wanted.startswith(name) for wanted in names):
+            continue
+        for r in f(calls):
+            if names and not any(r["name"].startswith(wanted) for wanted in names):
+                continue
+            results.append(r)
+            print(format_result(r), file=log, flush=True)
+    return {"machine": machine(), "calls": calls, "results": results}
+
+
+def machine_id(m):
+    """What decides whether numbers from two runs are comparable"""
+    return f"{m['host']}/{m['machine']}/{m['processor']}/{m['cpus']}"
+
+
+def benchmark_id(r):
+    return r["name"] + "".join(f" {k}={v}" for k, v in sorted(r["params"].items()))
+
+
+def append_history(report, path=HISTORY):
+    """Append every result of a run() report to the history, a line each."""
+    m = report["machine"]
+    with open(path, "a") as f:
+        for r in report["results"]:
+            if "skipped" in r:
+                continue
+            f.write(json.dumps(dict(r, commit=m["commit"], dirty=m["dirty"], machine=machine_id(m),
+                                    time=m["time"], python=m["python"], numpy=m["numpy"])) + "\n")
+
+
+def read_history(path=HISTORY):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def pooled(results):
+    """(mean, variance, n) of the per-call latencies of several runs of one benchmark, taken together."""
+    n = sum(r["calls"] for r in results)
+    mean = sum(r["latency_us"]["mean"] * r["calls"] for r in results) / n
+    # Within run sums of squares, plus between runs
+    ss = sum((r["calls"] - 1) * r["latency_us"]["std"] ** 2 + r["calls"] * (r["latency_us"]["mean"] - mean) ** 2
+             for r in results)
+    return mean, ss / max(n - 1, 1), n
+
+
+def _betacf(a, b, x):
+    """Continued fraction for the incomplete beta function, as in Numerical Recipes."""
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        for num in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                    -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + num * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + num / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-12:
+            break
+    return h
+
+
+def t_sf(t, df):
+    """P(T > t) for Student's t with df degrees of freedom."""
+    if t == 0:
+        return 0.5
+    if math.isinf(t):
+        return 0.0 if t > 0 else 1.0
+    x = df / (df + t * t)
+    a, b = df / 2.0, 0.5
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x))
+    # Regularized incomplete beta I_x(a, b), from whichever side converges
+    if x < (a + 1) / (a + b + 2):
+        ibeta = front * _betacf(a, b, x) / a
+    else:
+        ibeta = 1.0 - front * _betacf(b, a, 1.0 - x) / b
+    tail = 0.5 * ibeta
+    return tail if t > 0 else 1.0 - tail
+
+
+def welch(baseline, candidate):
+    """
+    One-sided Welch's t-test that candidate's latencies are higher than baseline's,
+        both given as (mean, variance, n). Returns (t, p).
+    """
+    (m1, v1, n1), (m2, v2, n2) = baseline, candidate
+    se2 = v1 / n1 + v2 / n2
+    if se2 == 0:
+        return (math.inf if m2 > m1 else -math.inf if m2 < m1 else 0.0), (0.0 if m2 > m1 else 1.0)
+    t = (m2 - m1) / math.sqrt(se2)
+    df = se2 ** 2 / ((v1 / n1) ** 2 / max(n1 - 1, 1) + (v2 / n2) ** 2 / max(n2 - 1, 1))
+    return t, t_sf(t, df)
+
+
+def compare(history, baseline=None, candidate=None, machine_key=None, slowdown=0.05, alpha=0.01):
+    """
+    Compare the benchmarks of two commits on one machine, see the module docstring.
+    Commits may be abbreviated, and default to the last two in the history, machine_key (see machine_id)
+        to this machine.
+
+    :return: (baseline, candidate, rows), each row a dict of the benchmark, both throughputs,
+        the relative change in mean latency, p and whether it's flagged as a regression.
+    """
+    if machine_key is None:
+        machine_key = machine_id(machine())
+    history = [r for r in history if r["machine"] == machine_key]
+    commits = list(dict.fromkeys(r["commit"] for r in history))
+
+    def resolve(commit):
+        matches = [c for c in commits if c and c.startswith(commit)]
+        if len(matches) != 1:
+            raise ValueError(f"{commit!r} matches {len(matches)} commits in the history for {machine_key}")
+        return matches[0]
+
+    candidate = resolve(candidate) if candidate else (commits[-1] if commits else None)
+    if baseline:
+        baseline = resolve(baseline)
+    else:
+        earlier = [c for c in commits if c != candidate]
+        baseline = earlier[-1] if earlier else None
+    if baseline is None or candidate is None:
+        raise ValueError(f"Need two commits in the history for {machine_key} to compare")
+
+    runs = {}
+    for r in history:
+        if r["commit"] in (baseline, candidate):
+            runs.setdefault(benchmark_id(r), {}).setdefault(r["commit"], []).append(r)
+
+    rows = []
+    for bench, by_commit in runs.items():
+        if baseline not in by_commit or candidate not in by_commit:
+            continue
+        before, after = pooled(by_commit[baseline]), pooled(by_commit[candidate])
+        t, p = welch(before, after)
+        change = after[0] / before[0] - 1
+        rows.append({
+            "benchmark": bench,
+            "baseline_steps_per_sec": np.mean([r["steps_per_sec"] for r in by_commit[baseline]]),
+            "candidate_steps_per_sec": np.mean([r["steps_per_sec"] for r in by_commit[candidate]]),
+            "latency_change": change,
+            "p": p,
+            "regression": change > slowdown and p < alpha,
+        })
+    return baseline, candidate, rows
+
+
+def format_result(r):
+    params = " ".join(f"{k}={v}" for k, v in r["params"].items())
+    if "skipped" in r:
+        return f"{r['name']:<32} {params:<40} skipped: {r['skipped']}"
+    lat = r["latency_us"]
+    return (f"{r['name']:<32} {params:<40} {r['steps_per_sec']:>12.0f} steps/s"
+            f"  p50 {lat['p50']:>9.1f}us  p99 {lat['p99']:>9.1f}us")
+
+
+def compare_main(args):
+    try:
+        baseline, candidate, rows = compare(read_history(args.history), args.baseline, args.candidate,
+                                            slowdown=args.slowdown, alpha=args.alpha)
+    except (OSError, ValueError) as e:
+        sys.exit(f"compare: {e}")
+    print(f"baseline {baseline[:12]}  candidate {candidate[:12]}")
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"{row['benchmark']:<72} {row['baseline_steps_per_sec']:>12.0f} -> {row['candidate_steps_per_sec']:>12.0f}"
+              f" steps/s  latency {row['latency_change']:>+7.1%}  p {row['p']:.2g}  {flag}")
+    regressions = [row for row in rows if row["regression"]]
+    print(f"{len(regressions)} of {len(rows)} benchmarks slower by more than {args.slowdown:.0%} (p < {args.alpha})")
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths")
+    commands = parser.add_subparsers(dest="command")
+    compare_parser = commands.add_parser("compare", help="Flag slowdowns between two commits in the history")
+    compare_parser.add_argument('baseline', nargs='?', help="Commit, the one before the candidate by default")
+    compare_parser.add_argument('candidate', nargs='?', help="Commit, the last one in the history by default")
+    compare_parser.add_argument('--history', default=HISTORY, metavar='PATH')
+    compare_parser.add_argument('--slowdown', type=float, default=0.05,
+                                help="Smallest increase in mean latency to flag, as a fraction")
+    compare_parser.add_argument('--alpha', type=float, default=0.01, help="Significance level")
+
+    parser.add_argument('--quick', action='store_true', help="Time 200 calls each instead of 2000")
+    parser.add_argument('--calls', type=int, default=None)
+    parser.add_argument('--only', nargs='+', metavar='NAME', help=f"Only these, or those starting with them: "
+                                                                   f"{', '.join(BENCHMARKS)}")
+    parser.add_argument('--json', metavar='PATH', help="Write the results here instead of stdout")
+    parser.add_argument('--turtle', action='store_true', help="Also time the turtle body.Body (needs a display)")
+    parser.add_argument('--history', nargs='?', const=HISTORY, metavar='PATH',
+                        help="Also append the results to the history file")
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare_main(args)
+        return
+
+    calls = args.calls if args.calls is not None else 200 if args.quick else 2000
+    report = run(args.only, calls, args.turtle)
+    if args.history:
+        append_history(report, args.history)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,34 @@
 import time
 import turtle
-turtle.speed(0)
-turtle.delay(0)
-turtle.ht()
 
-w = 3000
-h = 3000
+# Cage and movement settings are shared with the headless bodies
+from kinematics import w, h, vw, vh, cw, ch, max_mag, max_angle, wall_buffer, heading_buffer, left_trim, right_trim
+from kinematics import nose_touching
+from trail import Trail
 
-# Size of cage
-vw = w // 2
-vh = h // 2
-
-# "Actual" drawn size of cage
-cw = vw // 2
-ch = vh // 2
+tracer_interval = 100
 
-turtle.Screen().setup(w, h)
 
-tracer_interval = 100
-# Upper bounds for movements on a given timestep
-# set to 512 to disable normalization
-max_mag = 5
-#max_angle = 36  # So we move 10% of a full rotation at most
-#max_angle = 720 # Since this empirically is very small
-max_angle = 512
-#max_angle = 720 # Since this empirically is very small
+_screen_ready = False
 
-wall_buffer = 20
 
-# Set to 360 to disable heading checking entirely
-#heading_buffer = 45
-heading_buffer = 360
+def setup_screen():
+    """
+    Set up the turtle window, once. This used to run at import, which opened a window for anyone importing us.
+    """
+    global _screen_ready
+    if _screen_ready:
+        return
+    turtle.speed(0)
+    turtle.delay(0)
+    turtle.ht()
+    turtle.Screen().setup(w, h)
+    _screen_ready = True
 
 
 class Body(turtle.Turtle):
     def __init__(self, animate=False, *args, **kwargs):
+        setup_screen()
         super().__init__(*args, **kwargs)
         self.speed(0)
         #self.ht()
@@ -48,13 +42,21 @@ class Body(turtle.Turtle):
         self.enforce_cage = True
         self.cage = self.canvas.create_rectangle(-cw,ch,cw,-ch, width=3, outline="red")
 
-        self.left_trim = .56474 #Determined by running for 100k timesteps and getting average difference between left and right power
-        self.right_trim = 0
+        # The pen stays up, the trail is drawn as a few polylines instead of a line per move, see trail.py
+        self.penup()
+        self.trail = Trail(self.canvas)
+        self.trail.add(*self.pos(), self.pencolor())
+        self.moves = 0
+
+        self.left_trim = left_trim
+        self.right_trim = right_trim
 
         self.lefts = []
         self.rights = []
 
-        turtle.tracer(tracer_interval, 0)
+        # We update the screen ourselves in draw(), so moving the turtle is just arithmetic and all the
+        #   drawing happens in one place (which start_timing charges to the "render" phase)
+        turtle.tracer(0, 0)
         # self.ht() # hide body
 
     def cagecolor(self, color):
@@ -74,40 +76,36 @@ class Body(turtle.Turtle):
 
         if not self.sense_cage: return False
 
-        # For my own convenience I set x1,y1 to bot-left corner and x2,y2 to top-right
-        x1,y1,x2,y2 = -cw,-ch,cw,ch
+        # Same check as the headless bodies, see kinematics.nose_touching
         pos_x, pos_y = self.pos()
-        heading = self.heading()
-        dist_2d = lambda x1,x2: abs(x1-x2)
-
-        # Check each wall's case
-
-        # right wall, 315deg - 45deg centered on 0deg or 360deg
-        # have to compare both 0 and 360 since circles
-        if dist_2d(pos_x,x2) < wall_buffer and dist_2d(heading, 0) < heading_buffer and dist_2d(heading, 360) < heading_buffer:
-            return True
-
-        # top wall, 45deg - 135deg centered on 90deg
-        if dist_2d(pos_y, y2) < wall_buffer and dist_2d(heading, 90) < heading_buffer:
-            return True
-
-        # left wall, 135deg - 225deg centered on 180deg
-        if dist_2d(pos_x, x1) < wall_buffer and dist_2d(heading, 180) < heading_buffer:
-            return True
-
-        # bottom wall, 225deg - 315deg centered on 270deg
-        if dist_2d(pos_y, y1) < wall_buffer and dist_2d(heading, 270) < heading_buffer:
-            return True
-
-        # Otherwise, nope!
-        return False
-
+        return bool(nose_touching(pos_x, pos_y, self.heading()))
 
 
+    def snapshot(self):
+        """
+        Position and orientation, as a JSON-able dict for restore().
+        We keep turtle's orientation vector rather than heading(), since setheading() from degrees wouldn't
+            give back the exact same vector, and the trajectory would drift from the snapshotted one.
+        """
+        x, y = self.pos()
+        ox, oy = self._orient
+        return {"position": [x, y], "orientation": [ox, oy]}
+
+    def restore(self, state):
+        # Jump there without drawing a line
+        self.setpos(*state["position"])
+        self.trail.lift()
+        self.trail.add(*self.pos(), self.pencolor())
+        self._orient = turtle.Vec2D(*state["orientation"])
+        self._update()
+
+    def clear(self):
+        super().clear()
+        self.trail.clear()
 
     def exit(self):
         if not self.animate:
-            turtle.update()
+            self.draw()
             time.sleep(3)
 
     def normalize(self, angle, mag):
@@ -195,4 +193,14 @@ class Body(turtle.Turtle):
             # If not outside the box, no change, if outside the box, reset to the box bounds
             self.setpos(pos_x,pos_y)
 
+        self.trail.add(*self.pos(), self.pencolor())
+        self.moves += 1
+        if self.moves % tracer_interval == 0:
+            self.draw()
+
         return angle, mag
+
+    def draw(self):
+        """Bring the trail and the turtle on screen up to date, every tracer_interval moves."""
+        self.trail.draw()
+        turtle.update()
@@ -14,32 +14,54 @@
 # so if there were ever any neurons from this state that were going to influence the next state,
 # this would not get counted because it would reassign it.
 
-import argparse
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-v', '--verbose', action='count', default=0)
-# three levels of verbosity: [], -v, -vv
-# 0: only print starting and exiting messages
-# 1: print only when obstacles/food found
-# 2: print speed, left and right every time
-verbosity = parser.parse_args().verbose
-
-from body import Body
-body = Body()
+# Importing this module has no side effects (no argument parsing, no turtle window), so Nematode can be used
+# from pool workers, notebooks and benchmarks. Running it is what parses arguments and builds the turtle Body.
 
-import time
+import argparse
+import random
 import copy
-import signal
+import functools
 import sys
-import matplotlib.pyplot as plt
 import numpy as np
 from tqdm import tqdm
 #from neurons import *
 from collections import defaultdict
+import arrayfile
+from engine import CompiledConnectome, FusedConnectome, MotorReadout
+from neurons import NeuronIndex, LEFT_MUSCLES, RIGHT_MUSCLES
+from environment import Environment
+from hooks import Hooks
+from log import logger, start_logging, stop_logging, STEP, EVENT
+
+# Propagation engines Nematode can be built with.
+#   dict: the reference implementation, python dicts keyed by neuron name.
+#   csr: compiled numpy arrays, see engine.py. Produces the same curr/next values as dict.
+#   active: python lists by neuron id, only touching the neurons that fire and the ones they fire into.
+#       Also the same curr/next values as dict, at a cost per step that follows activity instead of connectome size.
+#   fused: csr, with the muscles folded into the left/right motor accumulators, see FusedConnectome in engine.py.
+#       curr/next only hold the non-muscle neurons (then left and right), which match dict, and motor output is the same.
+ENGINES = ("dict", "csr", "active", "fused")
+
+# Bumped whenever Nematode.snapshot() changes what it writes
+SNAPSHOT_FORMAT = 1
 
 class Nematode:
 
-    def __init__(self):
+    def __init__(self, engine="dict", body=None, environment=None, verbosity=0):
+        """
+        :param engine: one of ENGINES
+        :param body: what motorcontrol moves, and main() senses the cage with, e.g. body.Body.
+            Without one the brain still runs, but nothing is moved.
+        :param environment: an environment.Environment, the default one if not given
+        :param verbosity: 0, 1 or 2, see log.py
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+        self.engine = engine
+        self.body = body
+        self.environment = environment if environment is not None else Environment()
+        self.verbosity = verbosity
+
         # The post_synaptic dictionary contains the accumulated weighted values as the
         # connectome is executed
         self.post_synaptic = {}
@@ -49,51 +71,109 @@ class Nematode:
         self.nextState = 1
 
         # Load the initial values for the connectome and initialize curr, next
-        self.neurons = ['ADAL', 'ADAR', 'ADEL', 'ADER', 'ADFL', 'ADFR', 'ADLL', 'ADLR', 'AFDL', 'AFDR', 'AIAL', 'AIAR', 'AIBL', 'AIBR', 'AIML', 'AIMR', 'AINL', 'AINR', 'AIYL', 'AIYR', 'AIZL', 'AIZR', 'ALA', 'ALML', 'ALMR', 'ALNL', 'ALNR', 'AQR', 'AS1', 'AS10', 'AS11', 'AS2', 'AS3', 'AS4', 'AS5', 'AS6', 'AS7', 'AS8', 'AS9', 'ASEL', 'ASER', 'ASGL', 'ASGR', 'ASHL', 'ASHR', 'ASIL', 'ASIR', 'ASJL', 'ASJR', 'ASKL', 'ASKR', 'AUAL', 'AUAR', 'AVAL', 'AVAR', 'AVBL', 'AVBR', 'AVDL', 'AVDR', 'AVEL', 'AVER', 'AVFL', 'AVFR', 'AVG', 'AVHL', 'AVHR', 'AVJL', 'AVJR', 'AVKL', 'AVKR', 'AVL', 'AVM', 'AWAL', 'AWAR', 'AWBL', 'AWBR', 'AWCL', 'AWCR', 'BAGL', 'BAGR', 'BDUL', 'BDUR', 'CEPDL', 'CEPDR', 'CEPVL', 'CEPVR', 'DA1', 'DA2', 'DA3', 'DA4', 'DA5', 'DA6', 'DA7', 'DA8', 'DA9', 'DB1', 'DB2', 'DB3', 'DB4', 'DB5', 'DB6', 'DB7', 'DD1', 'DD2', 'DD3', 'DD4', 'DD5', 'DD6', 'DVA', 'DVB', 'DVC', 'FLPL', 'FLPR', 'HSNL', 'HSNR', 'I1L', 'I1R', 'I2L', 'I2R', 'I3', 'I4', 'I5', 'I6', 'IL1DL', 'IL1DR', 'IL1L', 'IL1R', 'IL1VL', 'IL1VR', 'IL2L', 'IL2R', 'IL2DL', 'IL2DR', 'IL2VL', 'IL2VR', 'LUAL', 'LUAR', 'M1', 'M2L', 'M2R', 'M3L', 'M3R', 'M4', 'M5', 'MANAL', 'MCL', 'MCR', 'MDL01', 'MDL02', 'MDL03', 'MDL04', 'MDL05', 'MDL06', 'MDL07', 'MDL08', 'MDL09', 'MDL10', 'MDL11', 'MDL12', 'MDL13', 'MDL14', 'MDL15', 'MDL16', 'MDL17', 'MDL18', 'MDL19', 'MDL20', 'MDL21', 'MDL22', 'MDL23', 'MDL24', 'MDR01', 'MDR02', 'MDR03', 'MDR04', 'MDR05', 'MDR06', 'MDR07', 'MDR08', 'MDR09', 'MDR10', 'MDR11', 'MDR12', 'MDR13', 'MDR14', 'MDR15', 'MDR16', 'MDR17', 'MDR18', 'MDR19', 'MDR20', 'MDR21', 'MDR22', 'MDR23', 'MDR24', 'MI', 'MVL01', 'MVL02', 'MVL03', 'MVL04', 'MVL05', 'MVL06', 'MVL07', 'MVL08', 'MVL09', 'MVL10', 'MVL11', 'MVL12', 'MVL13', 'MVL14', 'MVL15', 'MVL16', 'MVL17', 'MVL18', 'MVL19', 'MVL20', 'MVL21', 'MVL22', 'MVL23', 'MVR01', 'MVR02', 'MVR03', 'MVR04', 'MVR05', 'MVR06', 'MVR07', 'MVR08', 'MVR09', 'MVR10', 'MVR11', 'MVR12', 'MVR13', 'MVR14', 'MVR15', 'MVR16', 'MVR17', 'MVR18', 'MVR19', 'MVR20', 'MVR21', 'MVR22', 'MVR23', 'MVULVA', 'NSML', 'NSMR', 'OLLL', 'OLLR', 'OLQDL', 'OLQDR', 'OLQVL', 'OLQVR', 'PDA', 'PDB', 'PDEL', 'PDER', 'PHAL', 'PHAR', 'PHBL', 'PHBR', 'PHCL', 'PHCR', 'PLML', 'PLMR', 'PLNL', 'PLNR', 'PQR', 'PVCL', 'PVCR', 'PVDL', 'PVDR', 'PVM', 'PVNL', 'PVNR', 'PVPL', 'PVPR', 'PVQL', 'PVQR', 'PVR', 'PVT', 'PVWL', 'PVWR', 'RIAL', 'RIAR', 'RIBL', 'RIBR', 'RICL', 'RICR', 'RID', 'RIFL', 'RIFR', 'RIGL', 'RIGR', 'RIH', 'RIML', 'RIMR', 'RIPL', 'RIPR', 'RIR', 'RIS', 'RIVL', 'RIVR', 'RMDDL', 'RMDDR', 'RMDL', 'RMDR', 'RMDVL', 'RMDVR', 'RMED', 'RMEL', 'RMER', 'RMEV', 'RMFL', 'RMFR', 'RMGL', 'RMGR', 'RMHL', 'RMHR', 'SAADL', 'SAADR', 'SAAVL', 'SAAVR', 'SABD', 'SABVL', 'SABVR', 'SDQL', 'SDQR', 'SIADL', 'SIADR', 'SIAVL', 'SIAVR', 'SIBDL', 'SIBDR', 'SIBVL', 'SIBVR', 'SMBDL', 'SMBDR', 'SMBVL', 'SMBVR', 'SMDDL', 'SMDDR', 'SMDVL', 'SMDVR', 'URADL', 'URADR', 'URAVL', 'URAVR', 'URBL', 'URBR', 'URXL', 'URXR', 'URYDL', 'URYDR', 'URYVL', 'URYVR', 'VA1', 'VA10', 'VA11', 'VA12', 'VA2', 'VA3', 'VA4', 'VA5', 'VA6', 'VA7', 'VA8', 'VA9', 'VB1', 'VB10', 'VB11', 'VB2', 'VB3', 'VB4', 'VB5', 'VB6', 'VB7', 'VB8', 'VB9', 'VC1', 'VC2', 'VC3', 'VC4', 'VC5', 'VC6', 'VD1', 'VD10', 'VD11', 'VD12', 'VD13', 'VD2', 'VD3', 'VD4', 'VD5', 'VD6', 'VD7', 'VD8', 'VD9']
+        # Dense integer ids for every neuron name, see neurons.py
+        self.index = NeuronIndex()
+        self.neurons = self.index.names
         self.conn = defaultdict(lambda: []) # connectome
         self.curr = {}
         self.next = {}
 
-        # Get connections and weights
-        with open("neurons.txt", "r") as f:
-            for line in f:
-                connection = line.strip()
-                src,dst,w = connection.split(" ")
-                self.conn[src].append((dst,int(w)))
+        # Get connections and weights, compiled from neurons.txt (and cached next to it, see engine.py)
+        self.compiled = CompiledConnectome.load(index=self.index)
+        for src, dst, w in zip(self.compiled.src.tolist(), self.compiled.dst.tolist(), self.compiled.w.tolist()):
+            self.conn[self.neurons[src]].append((self.neurons[dst], w))
 
         # Populate curr and next with zeroes for each neuron
         for neuron in self.neurons:
             self.curr[neuron] = 0
             self.next[neuron] = 0
 
+        if self.engine == "csr":
+            # curr and next as numpy vectors indexed by neuron id.
+            self.curr = self.compiled.zeros()
+            self.next = self.compiled.zeros()
+            self.readout = MotorReadout(self.index)
+            self.propagate_connectome = self.propagate_csr
+            self.motorcontrol = self.motorcontrol_csr
+            self.accumulate = self.accumulate_ids
+            self.stimulate = self.stimulate_csr
+
+        elif self.engine == "fused":
+            self.fused = FusedConnectome(self.compiled)
+            self.curr = self.fused.zeros()
+            self.next = self.fused.zeros()
+            self.propagate_connectome = self.propagate_fused
+            self.motorcontrol = self.motorcontrol_fused
+            self.accumulate = self.accumulate_ids
+            self.stimulate = self.stimulate_fused
+
+        elif self.engine == "active":
+            self.curr = [0] * self.compiled.n
+            self.next = [0] * self.compiled.n
+            # ([dst], [w]) outputs of each neuron id, and whether it can fire at all
+            self.outputs = self.compiled.adjacency()
+            self.can_fire = self.compiled.can_fire.tolist()
+            # Ids above threshold in curr, and the threshold that was computed with
+            self.firing = set()
+            self.firing_threshold = None
+            # Ids of next written to since it was last copied into curr
+            self.touched = set()
+            # Ids of the left and right muscles, the only ones motorcontrol has to look at
+            self.motor_ids = frozenset(self.compiled.index.left_muscles.tolist() +
+                                       self.compiled.index.right_muscles.tolist())
+            self.propagate_connectome = self.propagate_active
+            self.motorcontrol = self.motorcontrol_active
+            self.accumulate = self.accumulate_ids
+            self.stimulate = self.stimulate_active
+
         # The threshold is the maximum sccumulated value that must be exceeded before the Neurite will fire
         self.threshold = 30
 
-        self.time_delays = False
+        # Paces main() in real time if set, see scheduler.py. Replaces the old time_delays sleep(0.1) per step.
+        self.scheduler = None
+
+        self.timestep = 0
 
         # Accumulators are used to decide the value to send to the Left and Right motors
-        # of the GoPiGo robot
+        # of the GoPiGo robot. They're reset at the start of each motorcontrol, so in between steps
+        # they hold the last values sent.
         self.accumleft = 0
         self.accumright = 0
 
+        # Wrappers of our methods (and the body's and environment's) for tracing, timing etc., see hooks.py
+        self.hooks = Hooks()
+
+        if self.verbosity >= 2:
+            # Log what motorcontrol sends to the body every step, only at -vv, see log.py
+            def logged(motorcontrol):
+                def motorcontrol_logged():
+                    motorcontrol()
+                    logger.log(STEP, "%d left %d right %d", self.timestep, self.accumleft, self.accumright)
+                return motorcontrol_logged
+
+            self.hooks.add("logging", self, "motorcontrol", logged)
+
         # Used to remove from Axon firing since muscles cannot fire.
         self.muscles = ['MVU', 'MVL', 'MDL', 'MVR', 'MDR']
 
 
-        self.mLeft =  ['MDL01', 'MDL02', 'MDL03', 'MDL04', 'MDL05', 'MDL06', 'MDL07', 'MDL08', 'MDL09', 'MDL10',
-                  'MDL11', 'MDL12', 'MDL13', 'MDL14', 'MDL15', 'MDL16', 'MDL17', 'MDL18', 'MDL19', 'MDL20',
-                  'MDL21', 'MDL22', 'MDL23', 'MDL24', 'MVL01', 'MVL02', 'MVL03', 'MVL04', 'MVL05', 'MVL06',
-                  'MVL07', 'MVL08', 'MVL09', 'MVL10', 'MVL11', 'MVL12', 'MVL13', 'MVL14', 'MVL15', 'MVL16',
-                  'MVL17', 'MVL18', 'MVL19', 'MVL20', 'MVL21', 'MVL22', 'MVL23']
-
-        self.mRight = ['MDR01', 'MDR02', 'MDR03', 'MDR04', 'MDR05', 'MDR06', 'MDR07', 'MDR08', 'MDR09', 'MDR10',
-                  'MDR11', 'MDR12', 'MDR13', 'MDR14', 'MDR15', 'MDR16', 'MDR17', 'MDR18', 'MDR19', 'MDR20',
-                  'MDR21', 'MDR22', 'MDR23', 'MDR24', 'MVR01', 'MVR02', 'MVR03', 'MVR04', 'MVR05', 'MVR06',
-                  'MVR07', 'MVR08', 'MVR09', 'MVR10', 'MVR11', 'MVR12', 'MVR13', 'MVR14', 'MVR15', 'MVR16',
-                  'MVR17', 'MVR18', 'MVR19', 'MVR20', 'MVR21', 'MVR22', 'MVR23']
-        for m in self.mLeft + self.mRight + ["MVULVA"]:
-            self.curr[m] = 0
-            self.next[m] = 0
+        self.mLeft = list(LEFT_MUSCLES)
+
+        self.mRight = list(RIGHT_MUSCLES)
+        if self.engine == "dict":
+            for m in self.mLeft + self.mRight + ["MVULVA"]:
+                self.curr[m] = 0
+                self.next[m] = 0
+
+        # Which muscle group each neuron id is in, 1 for left, 2 for right, 0 otherwise.
+        # Saves scanning mLeft and mRight for every neuron.
+        self.side = [0] * len(self.index)
+        for i in self.index.left_muscles.tolist():
+            self.side[i] = 1
+        for i in self.index.right_muscles.tolist():
+            self.side[i] = 2
+        # Just the (neuron, side) of the muscles, in neuron order
+        self.motor_neurons = [(neuron, side) for neuron, side in zip(self.neurons, self.side) if side]
         # Used to accumulate muscle weighted values in body muscles 07-23 = worm locomotion
 
 
@@ -109,402 +189,8 @@ class Nematode:
     def create_post_synaptic(self):
         # The post_synaptic dictionary maintains the accumulated values for
         # each neuron and muscle. The Accumulated values are initialized to Zero
-        self.post_synaptic['ADAL'] = [0, 0]
-        self.post_synaptic['ADAR'] = [0, 0]
-        self.post_synaptic['ADEL'] = [0, 0]
-        self.post_synaptic['ADER'] = [0, 0]
-        self.post_synaptic['ADFL'] = [0, 0]
-        self.post_synaptic['ADFR'] = [0, 0]
-        self.post_synaptic['ADLL'] = [0, 0]
-        self.post_synaptic['ADLR'] = [0, 0]
-        self.post_synaptic['AFDL'] = [0, 0]
-        self.post_synaptic['AFDR'] = [0, 0]
-        self.post_synaptic['AIAL'] = [0, 0]
-        self.post_synaptic['AIAR'] = [0, 0]
-        self.post_synaptic['AIBL'] = [0, 0]
-        self.post_synaptic['AIBR'] = [0, 0]
-        self.post_synaptic['AIML'] = [0, 0]
-        self.post_synaptic['AIMR'] = [0, 0]
-        self.post_synaptic['AINL'] = [0, 0]
-        self.post_synaptic['AINR'] = [0, 0]
-        self.post_synaptic['AIYL'] = [0, 0]
-        self.post_synaptic['AIYR'] = [0, 0]
-        self.post_synaptic['AIZL'] = [0, 0]
-        self.post_synaptic['AIZR'] = [0, 0]
-        self.post_synaptic['ALA'] = [0, 0]
-        self.post_synaptic['ALML'] = [0, 0]
-        self.post_synaptic['ALMR'] = [0, 0]
-        self.post_synaptic['ALNL'] = [0, 0]
-        self.post_synaptic['ALNR'] = [0, 0]
-        self.post_synaptic['AQR'] = [0, 0]
-        self.post_synaptic['AS1'] = [0, 0]
-        self.post_synaptic['AS10'] = [0, 0]
-        self.post_synaptic['AS11'] = [0, 0]
-        self.post_synaptic['AS2'] = [0, 0]
-        self.post_synaptic['AS3'] = [0, 0]
-        self.post_synaptic['AS4'] = [0, 0]
-        self.post_synaptic['AS5'] = [0, 0]
-        self.post_synaptic['AS6'] = [0, 0]
-        self.post_synaptic['AS7'] = [0, 0]
-        self.post_synaptic['AS8'] = [0, 0]
-        self.post_synaptic['AS9'] = [0, 0]
-        self.post_synaptic['ASEL'] = [0, 0]
-        self.post_synaptic['ASER'] = [0, 0]
-        self.post_synaptic['ASGL'] = [0, 0]
-        self.post_synaptic['ASGR'] = [0, 0]
-        self.post_synaptic['ASHL'] = [0, 0]
-        self.post_synaptic['ASHR'] = [0, 0]
-        self.post_synaptic['ASIL'] = [0, 0]
-        self.post_synaptic['ASIR'] = [0, 0]
-        self.post_synaptic['ASJL'] = [0, 0]
-        self.post_synaptic['ASJR'] = [0, 0]
-        self.post_synaptic['ASKL'] = [0, 0]
-        self.post_synaptic['ASKR'] = [0, 0]
-        self.post_synaptic['AUAL'] = [0, 0]
-        self.post_synaptic['AUAR'] = [0, 0]
-        self.post_synaptic['AVAL'] = [0, 0]
-        self.post_synaptic['AVAR'] = [0, 0]
-        self.post_synaptic['AVBL'] = [0, 0]
-        self.post_synaptic['AVBR'] = [0, 0]
-        self.post_synaptic['AVDL'] = [0, 0]
-        self.post_synaptic['AVDR'] = [0, 0]
-        self.post_synaptic['AVEL'] = [0, 0]
-        self.post_synaptic['AVER'] = [0, 0]
-        self.post_synaptic['AVFL'] = [0, 0]
-        self.post_synaptic['AVFR'] = [0, 0]
-        self.post_synaptic['AVG'] = [0, 0]
-        self.post_synaptic['AVHL'] = [0, 0]
-        self.post_synaptic['AVHR'] = [0, 0]
-        self.post_synaptic['AVJL'] = [0, 0]
-        self.post_synaptic['AVJR'] = [0, 0]
-        self.post_synaptic['AVKL'] = [0, 0]
-        self.post_synaptic['AVKR'] = [0, 0]
-        self.post_synaptic['AVL'] = [0, 0]
-        self.post_synaptic['AVM'] = [0, 0]
-        self.post_synaptic['AWAL'] = [0, 0]
-        self.post_synaptic['AWAR'] = [0, 0]
-        self.post_synaptic['AWBL'] = [0, 0]
-        self.post_synaptic['AWBR'] = [0, 0]
-        self.post_synaptic['AWCL'] = [0, 0]
-        self.post_synaptic['AWCR'] = [0, 0]
-        self.post_synaptic['BAGL'] = [0, 0]
-        self.post_synaptic['BAGR'] = [0, 0]
-        self.post_synaptic['BDUL'] = [0, 0]
-        self.post_synaptic['BDUR'] = [0, 0]
-        self.post_synaptic['CEPDL'] = [0, 0]
-        self.post_synaptic['CEPDR'] = [0, 0]
-        self.post_synaptic['CEPVL'] = [0, 0]
-        self.post_synaptic['CEPVR'] = [0, 0]
-        self.post_synaptic['DA1'] = [0, 0]
-        self.post_synaptic['DA2'] = [0, 0]
-        self.post_synaptic['DA3'] = [0, 0]
-        self.post_synaptic['DA4'] = [0, 0]
-        self.post_synaptic['DA5'] = [0, 0]
-        self.post_synaptic['DA6'] = [0, 0]
-        self.post_synaptic['DA7'] = [0, 0]
-        self.post_synaptic['DA8'] = [0, 0]
-        self.post_synaptic['DA9'] = [0, 0]
-        self.post_synaptic['DB1'] = [0, 0]
-        self.post_synaptic['DB2'] = [0, 0]
-        self.post_synaptic['DB3'] = [0, 0]
-        self.post_synaptic['DB4'] = [0, 0]
-        self.post_synaptic['DB5'] = [0, 0]
-        self.post_synaptic['DB6'] = [0, 0]
-        self.post_synaptic['DB7'] = [0, 0]
-        self.post_synaptic['DD1'] = [0, 0]
-        self.post_synaptic['DD2'] = [0, 0]
-        self.post_synaptic['DD3'] = [0, 0]
-        self.post_synaptic['DD4'] = [0, 0]
-        self.post_synaptic['DD5'] = [0, 0]
-        self.post_synaptic['DD6'] = [0, 0]
-        self.post_synaptic['DVA'] = [0, 0]
-        self.post_synaptic['DVB'] = [0, 0]
-        self.post_synaptic['DVC'] = [0, 0]
-        self.post_synaptic['FLPL'] = [0, 0]
-        self.post_synaptic['FLPR'] = [0, 0]
-        self.post_synaptic['HSNL'] = [0, 0]
-        self.post_synaptic['HSNR'] = [0, 0]
-        self.post_synaptic['I1L'] = [0, 0]
-        self.post_synaptic['I1R'] = [0, 0]
-        self.post_synaptic['I2L'] = [0, 0]
-        self.post_synaptic['I2R'] = [0, 0]
-        self.post_synaptic['I3'] = [0, 0]
-        self.post_synaptic['I4'] = [0, 0]
-        self.post_synaptic['I5'] = [0, 0]
-        self.post_synaptic['I6'] = [0, 0]
-        self.post_synaptic['IL1DL'] = [0, 0]
-        self.post_synaptic['IL1DR'] = [0, 0]
-        self.post_synaptic['IL1L'] = [0, 0]
-        self.post_synaptic['IL1R'] = [0, 0]
-        self.post_synaptic['IL1VL'] = [0, 0]
-        self.post_synaptic['IL1VR'] = [0, 0]
-        self.post_synaptic['IL2L'] = [0, 0]
-        self.post_synaptic['IL2R'] = [0, 0]
-        self.post_synaptic['IL2DL'] = [0, 0]
-        self.post_synaptic['IL2DR'] = [0, 0]
-        self.post_synaptic['IL2VL'] = [0, 0]
-        self.post_synaptic['IL2VR'] = [0, 0]
-        self.post_synaptic['LUAL'] = [0, 0]
-        self.post_synaptic['LUAR'] = [0, 0]
-        self.post_synaptic['M1'] = [0, 0]
-        self.post_synaptic['M2L'] = [0, 0]
-        self.post_synaptic['M2R'] = [0, 0]
-        self.post_synaptic['M3L'] = [0, 0]
-        self.post_synaptic['M3R'] = [0, 0]
-        self.post_synaptic['M4'] = [0, 0]
-        self.post_synaptic['M5'] = [0, 0]
-        self.post_synaptic['MANAL'] = [0, 0]
-        self.post_synaptic['MCL'] = [0, 0]
-        self.post_synaptic['MCR'] = [0, 0]
-        self.post_synaptic['MDL01'] = [0, 0]
-        self.post_synaptic['MDL02'] = [0, 0]
-        self.post_synaptic['MDL03'] = [0, 0]
-        self.post_synaptic['MDL04'] = [0, 0]
-        self.post_synaptic['MDL05'] = [0, 0]
-        self.post_synaptic['MDL06'] = [0, 0]
-        self.post_synaptic['MDL07'] = [0, 0]
-        self.post_synaptic['MDL08'] = [0, 0]
-        self.post_synaptic['MDL09'] = [0, 0]
-        self.post_synaptic['MDL10'] = [0, 0]
-        self.post_synaptic['MDL11'] = [0, 0]
-        self.post_synaptic['MDL12'] = [0, 0]
-        self.post_synaptic['MDL13'] = [0, 0]
-        self.post_synaptic['MDL14'] = [0, 0]
-        self.post_synaptic['MDL15'] = [0, 0]
-        self.post_synaptic['MDL16'] = [0, 0]
-        self.post_synaptic['MDL17'] = [0, 0]
-        self.post_synaptic['MDL18'] = [0, 0]
-        self.post_synaptic['MDL19'] = [0, 0]
-        self.post_synaptic['MDL20'] = [0, 0]
-        self.post_synaptic['MDL21'] = [0, 0]
-        self.post_synaptic['MDL22'] = [0, 0]
-        self.post_synaptic['MDL23'] = [0, 0]
-        self.post_synaptic['MDL24'] = [0, 0]
-        self.post_synaptic['MDR01'] = [0, 0]
-        self.post_synaptic['MDR02'] = [0, 0]
-        self.post_synaptic['MDR03'] = [0, 0]
-        self.post_synaptic['MDR04'] = [0, 0]
-        self.post_synaptic['MDR05'] = [0, 0]
-        self.post_synaptic['MDR06'] = [0, 0]
-        self.post_synaptic['MDR07'] = [0, 0]
-        self.post_synaptic['MDR08'] = [0, 0]
-        self.post_synaptic['MDR09'] = [0, 0]
-        self.post_synaptic['MDR10'] = [0, 0]
-        self.post_synaptic['MDR11'] = [0, 0]
-        self.post_synaptic['MDR12'] = [0, 0]
-        self.post_synaptic['MDR13'] = [0, 0]
-        self.post_synaptic['MDR14'] = [0, 0]
-        self.post_synaptic['MDR15'] = [0, 0]
-        self.post_synaptic['MDR16'] = [0, 0]
-        self.post_synaptic['MDR17'] = [0, 0]
-        self.post_synaptic['MDR18'] = [0, 0]
-        self.post_synaptic['MDR19'] = [0, 0]
-        self.post_synaptic['MDR20'] = [0, 0]
-        self.post_synaptic['MDR21'] = [0, 0]
-        self.post_synaptic['MDR22'] = [0, 0]
-        self.post_synaptic['MDR23'] = [0, 0]
-        self.post_synaptic['MDR24'] = [0, 0]
-        self.post_synaptic['MI'] = [0, 0]
-        self.post_synaptic['MVL01'] = [0, 0]
-        self.post_synaptic['MVL02'] = [0, 0]
-        self.post_synaptic['MVL03'] = [0, 0]
-        self.post_synaptic['MVL04'] = [0, 0]
-        self.post_synaptic['MVL05'] = [0, 0]
-        self.post_synaptic['MVL06'] = [0, 0]
-        self.post_synaptic['MVL07'] = [0, 0]
-        self.post_synaptic['MVL08'] = [0, 0]
-        self.post_synaptic['MVL09'] = [0, 0]
-        self.post_synaptic['MVL10'] = [0, 0]
-        self.post_synaptic['MVL11'] = [0, 0]
-        self.post_synaptic['MVL12'] = [0, 0]
-        self.post_synaptic['MVL13'] = [0, 0]
-        self.post_synaptic['MVL14'] = [0, 0]
-        self.post_synaptic['MVL15'] = [0, 0]
-        self.post_synaptic['MVL16'] = [0, 0]
-        self.post_synaptic['MVL17'] = [0, 0]
-        self.post_synaptic['MVL18'] = [0, 0]
-        self.post_synaptic['MVL19'] = [0, 0]
-        self.post_synaptic['MVL20'] = [0, 0]
-        self.post_synaptic['MVL21'] = [0, 0]
-        self.post_synaptic['MVL22'] = [0, 0]
-        self.post_synaptic['MVL23'] = [0, 0]
-        self.post_synaptic['MVR01'] = [0, 0]
-        self.post_synaptic['MVR02'] = [0, 0]
-        self.post_synaptic['MVR03'] = [0, 0]
-        self.post_synaptic['MVR04'] = [0, 0]
-        self.post_synaptic['MVR05'] = [0, 0]
-        self.post_synaptic['MVR06'] = [0, 0]
-        self.post_synaptic['MVR07'] = [0, 0]
-        self.post_synaptic['MVR08'] = [0, 0]
-        self.post_synaptic['MVR09'] = [0, 0]
-        self.post_synaptic['MVR10'] = [0, 0]
-        self.post_synaptic['MVR11'] = [0, 0]
-        self.post_synaptic['MVR12'] = [0, 0]
-        self.post_synaptic['MVR13'] = [0, 0]
-        self.post_synaptic['MVR14'] = [0, 0]
-        self.post_synaptic['MVR15'] = [0, 0]
-        self.post_synaptic['MVR16'] = [0, 0]
-        self.post_synaptic['MVR17'] = [0, 0]
-        self.post_synaptic['MVR18'] = [0, 0]
-        self.post_synaptic['MVR19'] = [0, 0]
-        self.post_synaptic['MVR20'] = [0, 0]
-        self.post_synaptic['MVR21'] = [0, 0]
-        self.post_synaptic['MVR22'] = [0, 0]
-        self.post_synaptic['MVR23'] = [0, 0]
-        self.post_synaptic['MVULVA'] = [0, 0]
-        self.post_synaptic['NSML'] = [0, 0]
-        self.post_synaptic['NSMR'] = [0, 0]
-        self.post_synaptic['OLLL'] = [0, 0]
-        self.post_synaptic['OLLR'] = [0, 0]
-        self.post_synaptic['OLQDL'] = [0, 0]
-        self.post_synaptic['OLQDR'] = [0, 0]
-        self.post_synaptic['OLQVL'] = [0, 0]
-        self.post_synaptic['OLQVR'] = [0, 0]
-        self.post_synaptic['PDA'] = [0, 0]
-        self.post_synaptic['PDB'] = [0, 0]
-        self.post_synaptic['PDEL'] = [0, 0]
-        self.post_synaptic['PDER'] = [0, 0]
-        self.post_synaptic['PHAL'] = [0, 0]
-        self.post_synaptic['PHAR'] = [0, 0]
-        self.post_synaptic['PHBL'] = [0, 0]
-        self.post_synaptic['PHBR'] = [0, 0]
-        self.post_synaptic['PHCL'] = [0, 0]
-        self.post_synaptic['PHCR'] = [0, 0]
-        self.post_synaptic['PLML'] = [0, 0]
-        self.post_synaptic['PLMR'] = [0, 0]
-        self.post_synaptic['PLNL'] = [0, 0]
-        self.post_synaptic['PLNR'] = [0, 0]
-        self.post_synaptic['PQR'] = [0, 0]
-        self.post_synaptic['PVCL'] = [0, 0]
-        self.post_synaptic['PVCR'] = [0, 0]
-        self.post_synaptic['PVDL'] = [0, 0]
-        self.post_synaptic['PVDR'] = [0, 0]
-        self.post_synaptic['PVM'] = [0, 0]
-        self.post_synaptic['PVNL'] = [0, 0]
-        self.post_synaptic['PVNR'] = [0, 0]
-        self.post_synaptic['PVPL'] = [0, 0]
-        self.post_synaptic['PVPR'] = [0, 0]
-        self.post_synaptic['PVQL'] = [0, 0]
-        self.post_synaptic['PVQR'] = [0, 0]
-        self.post_synaptic['PVR'] = [0, 0]
-        self.post_synaptic['PVT'] = [0, 0]
-        self.post_synaptic['PVWL'] = [0, 0]
-        self.post_synaptic['PVWR'] = [0, 0]
-        self.post_synaptic['RIAL'] = [0, 0]
-        self.post_synaptic['RIAR'] = [0, 0]
-        self.post_synaptic['RIBL'] = [0, 0]
-        self.post_synaptic['RIBR'] = [0, 0]
-        self.post_synaptic['RICL'] = [0, 0]
-        self.post_synaptic['RICR'] = [0, 0]
-        self.post_synaptic['RID'] = [0, 0]
-        self.post_synaptic['RIFL'] = [0, 0]
-        self.post_synaptic['RIFR'] = [0, 0]
-        self.post_synaptic['RIGL'] = [0, 0]
-        self.post_synaptic['RIGR'] = [0, 0]
-        self.post_synaptic['RIH'] = [0, 0]
-        self.post_synaptic['RIML'] = [0, 0]
-        self.post_synaptic['RIMR'] = [0, 0]
-        self.post_synaptic['RIPL'] = [0, 0]
-        self.post_synaptic['RIPR'] = [0, 0]
-        self.post_synaptic['RIR'] = [0, 0]
-        self.post_synaptic['RIS'] = [0, 0]
-        self.post_synaptic['RIVL'] = [0, 0]
-        self.post_synaptic['RIVR'] = [0, 0]
-        self.post_synaptic['RMDDL'] = [0, 0]
-        self.post_synaptic['RMDDR'] = [0, 0]
-        self.post_synaptic['RMDL'] = [0, 0]
-        self.post_synaptic['RMDR'] = [0, 0]
-        self.post_synaptic['RMDVL'] = [0, 0]
-        self.post_synaptic['RMDVR'] = [0, 0]
-        self.post_synaptic['RMED'] = [0, 0]
-        self.post_synaptic['RMEL'] = [0, 0]
-        self.post_synaptic['RMER'] = [0, 0]
-        self.post_synaptic['RMEV'] = [0, 0]
-        self.post_synaptic['RMFL'] = [0, 0]
-        self.post_synaptic['RMFR'] = [0, 0]
-        self.post_synaptic['RMGL'] = [0, 0]
-        self.post_synaptic['RMGR'] = [0, 0]
-        self.post_synaptic['RMHL'] = [0, 0]
-        self.post_synaptic['RMHR'] = [0, 0]
-        self.post_synaptic['SAADL'] = [0, 0]
-        self.post_synaptic['SAADR'] = [0, 0]
-        self.post_synaptic['SAAVL'] = [0, 0]
-        self.post_synaptic['SAAVR'] = [0, 0]
-        self.post_synaptic['SABD'] = [0, 0]
-        self.post_synaptic['SABVL'] = [0, 0]
-        self.post_synaptic['SABVR'] = [0, 0]
-        self.post_synaptic['SDQL'] = [0, 0]
-        self.post_synaptic['SDQR'] = [0, 0]
-        self.post_synaptic['SIADL'] = [0, 0]
-        self.post_synaptic['SIADR'] = [0, 0]
-        self.post_synaptic['SIAVL'] = [0, 0]
-        self.post_synaptic['SIAVR'] = [0, 0]
-        self.post_synaptic['SIBDL'] = [0, 0]
-        self.post_synaptic['SIBDR'] = [0, 0]
-        self.post_synaptic['SIBVL'] = [0, 0]
-        self.post_synaptic['SIBVR'] = [0, 0]
-        self.post_synaptic['SMBDL'] = [0, 0]
-        self.post_synaptic['SMBDR'] = [0, 0]
-        self.post_synaptic['SMBVL'] = [0, 0]
-        self.post_synaptic['SMBVR'] = [0, 0]
-        self.post_synaptic['SMDDL'] = [0, 0]
-        self.post_synaptic['SMDDR'] = [0, 0]
-        self.post_synaptic['SMDVL'] = [0, 0]
-        self.post_synaptic['SMDVR'] = [0, 0]
-        self.post_synaptic['URADL'] = [0, 0]
-        self.post_synaptic['URADR'] = [0, 0]
-        self.post_synaptic['URAVL'] = [0, 0]
-        self.post_synaptic['URAVR'] = [0, 0]
-        self.post_synaptic['URBL'] = [0, 0]
-        self.post_synaptic['URBR'] = [0, 0]
-        self.post_synaptic['URXL'] = [0, 0]
-        self.post_synaptic['URXR'] = [0, 0]
-        self.post_synaptic['URYDL'] = [0, 0]
-        self.post_synaptic['URYDR'] = [0, 0]
-        self.post_synaptic['URYVL'] = [0, 0]
-        self.post_synaptic['URYVR'] = [0, 0]
-        self.post_synaptic['VA1'] = [0, 0]
-        self.post_synaptic['VA10'] = [0, 0]
-        self.post_synaptic['VA11'] = [0, 0]
-        self.post_synaptic['VA12'] = [0, 0]
-        self.post_synaptic['VA2'] = [0, 0]
-        self.post_synaptic['VA3'] = [0, 0]
-        self.post_synaptic['VA4'] = [0, 0]
-        self.post_synaptic['VA5'] = [0, 0]
-        self.post_synaptic['VA6'] = [0, 0]
-        self.post_synaptic['VA7'] = [0, 0]
-        self.post_synaptic['VA8'] = [0, 0]
-        self.post_synaptic['VA9'] = [0, 0]
-        self.post_synaptic['VB1'] = [0, 0]
-        self.post_synaptic['VB10'] = [0, 0]
-        self.post_synaptic['VB11'] = [0, 0]
-        self.post_synaptic['VB2'] = [0, 0]
-        self.post_synaptic['VB3'] = [0, 0]
-        self.post_synaptic['VB4'] = [0, 0]
-        self.post_synaptic['VB5'] = [0, 0]
-        self.post_synaptic['VB6'] = [0, 0]
-        self.post_synaptic['VB7'] = [0, 0]
-        self.post_synaptic['VB8'] = [0, 0]
-        self.post_synaptic['VB9'] = [0, 0]
-        self.post_synaptic['VC1'] = [0, 0]
-        self.post_synaptic['VC2'] = [0, 0]
-        self.post_synaptic['VC3'] = [0, 0]
-        self.post_synaptic['VC4'] = [0, 0]
-        self.post_synaptic['VC5'] = [0, 0]
-        self.post_synaptic['VC6'] = [0, 0]
-        self.post_synaptic['VD1'] = [0, 0]
-        self.post_synaptic['VD10'] = [0, 0]
-        self.post_synaptic['VD11'] = [0, 0]
-        self.post_synaptic['VD12'] = [0, 0]
-        self.post_synaptic['VD13'] = [0, 0]
-        self.post_synaptic['VD2'] = [0, 0]
-        self.post_synaptic['VD3'] = [0, 0]
-        self.post_synaptic['VD4'] = [0, 0]
-        self.post_synaptic['VD5'] = [0, 0]
-        self.post_synaptic['VD6'] = [0, 0]
-        self.post_synaptic['VD7'] = [0, 0]
-        self.post_synaptic['VD8'] = [0, 0]
-        self.post_synaptic['VD9'] = [0, 0]
+        for neuron in self.neurons:
+            self.post_synaptic[neuron] = [0, 0]
 
 
     # todo make class for brain with these as class variables
@@ -530,7 +216,7 @@ class Nematode:
                 # self.post_synaptic[muscle][thisState] = 0
                 self.post_synaptic[muscle][nextState] = 0
 
-        angle, mag = body.move(self.accumleft, self.accumright)
+        angle, mag = self.body.move(self.accumleft, self.accumright)
         accumleft = 0
         accumright = 0
 
@@ -541,16 +227,17 @@ class Nematode:
 
         Reset the values after.
         """
-        # TODO WHY ON EARTH IS THIS CODE PRODUCING DIFFERENT ACCUMLEFT VALUES AT TIMESTEP 99 AS OPPOSED
-        # TO THE COMMENTED CODE RIGHT BELOW IT???
-        for neuron in self.neurons:
-            if neuron in self.mLeft:
-                if self.timestep == 997:
-                    print(self.accumleft, self.next[neuron], neuron)
+        # Only the muscles, in the same order as going through all of self.neurons would.
+        # (The commented code below gave different accumleft values because of the neurons.py comments bug,
+        # see the bottom of this file, they add up the same.)
+        self.accumleft = 0
+        self.accumright = 0
+        for neuron, side in self.motor_neurons:
+            if side == 1:
                 self.accumleft += self.next[neuron]
                 self.next[neuron] = 0
 
-            elif neuron in self.mRight:
+            elif side == 2:
                 self.accumright += self.next[neuron]
                 self.next[neuron] = 0
         # for muscle in self.mLeft:
@@ -562,10 +249,8 @@ class Nematode:
         #     self.next[muscle] = 0
 
         # Apply and move body???
-        print(self.accumleft, self.accumright)
-        angle, mag = body.move(self.accumleft, self.accumright)
-        self.accumleft = 0
-        self.accumright = 0
+        if self.body is not None:
+            angle, mag = self.body.move(self.accumleft, self.accumright)
 
 
 
@@ -585,6 +270,14 @@ class Nematode:
             # post_synaptic[fneuron][thisState] = 0
             self.post_synaptic[fneuron][nextState] = 0
 
+    def stimulate(self, neurons):
+        """
+        Accumulate every neuron id in neurons, e.g. one of the sensor groups of self.index.
+        The id based engines replace this, the dict engine has to go through the names.
+        """
+        for neuron in neurons:
+            self.accumulate(self.neurons[neuron])
+
     # Still not sure why these two are separate.
     def accumulate(self, dendrite):
         # Fire neuron only, don't set value to 0
@@ -596,8 +289,6 @@ class Nematode:
         # Fire neuron, and set it's next value to 0 since it's post-fire.
 
         for dst,w in self.conn[neuron]:
-            if self.timestep == 997 and dst == "MDL21":
-                print(neuron, dst, w)
             self.next[dst] += w
 
         # TODO set them to zero after the propagation?
@@ -649,16 +340,12 @@ class Nematode:
         We will update curr to be next by the end of this function.
         """
         for neuron in self.neurons:
-            if self.timestep == 997 and neuron == "MDL21":
-                print(self.curr[neuron])
             # for neuron, signal in self.curr.items():
             #     # If not a muscle, and signal above threshold
             #     # TODO WHY IS ABS HERE??? - oh, because it's just magnitude
             #     if neuron[:3] not in self.muscles and abs(signal) > self.threshold:
             #         self.fire(neuron)
             if neuron[:3] not in self.muscles and abs(self.curr[neuron]) > self.threshold:
-                if self.timestep == 997 and neuron == "RID":
-                    print(neuron, self.curr[neuron])
                 self.fire(neuron)
 
         self.motorcontrol()
@@ -668,6 +355,438 @@ class Nematode:
         for neuron,signal in self.next.items():
             self.curr[neuron] = signal
 
+    def propagate_csr(self):
+        """
+        propagate_connectome for the csr engine: fire everything in curr above threshold with one sparse mat-vec
+            into next, read the muscles, and copy next into curr.
+        """
+        self.compiled.propagate(self.curr, self.next, self.threshold)
+        self.motorcontrol()
+        np.copyto(self.curr, self.next)
+
+    def motorcontrol_csr(self):
+        """motorcontrol for the csr engine, reading both sides with one readout matmul and one masked reset."""
+        left, right = self.readout.read(self.next)
+        self.accumleft = int(left)
+        self.accumright = int(right)
+
+        if self.body is not None:
+            angle, mag = self.body.move(self.accumleft, self.accumright)
+
+    def stimulate_csr(self, neurons):
+        for neuron in neurons:
+            self.compiled.stimulate(self.next, neuron)
+
+    def propagate_fused(self):
+        """
+        propagate_connectome for the fused engine, firing neurons add straight into the motor accumulators
+            at the end of next in the same mat-vec.
+        """
+        self.fused.propagate(self.curr, self.next, self.threshold)
+        self.motorcontrol()
+        np.copyto(self.curr, self.next)
+
+    def motorcontrol_fused(self):
+        left, right = self.fused.read_motors(self.next)
+        self.accumleft = left
+        self.accumright = right
+
+        if self.body is not None:
+            angle, mag = self.body.move(self.accumleft, self.accumright)
+
+    def stimulate_fused(self, neurons):
+        for neuron in neurons:
+            self.fused.stimulate(self.next, neuron)
+
+    def propagate_active(self):
+        """
+        propagate_connectome for the active engine.
+
+        Instead of scanning every neuron, we keep the set of neurons above threshold in curr, and fire just those,
+            in id order like the dict engine. Every write to next is remembered in self.touched, so that afterwards
+            only those neurons need copying into curr and checking against the threshold for the next step.
+        """
+        if self.firing_threshold != self.threshold:
+            # Threshold was changed, so our firing set is stale
+            self.firing = {i for i, v in enumerate(self.curr) if self.can_fire[i] and abs(v) > self.threshold}
+            self.firing_threshold = self.threshold
+
+        nxt = self.next
+        touched = self.touched
+        for neuron in sorted(self.firing):
+            dsts, ws = self.outputs[neuron]
+            for dst, w in zip(dsts, ws):
+                nxt[dst] += w
+            touched.update(dsts)
+            nxt[neuron] = 0
+            touched.add(neuron)
+
+        self.motorcontrol()
+
+        # Update curr to now be next, for just the neurons that changed
+        curr = self.curr
+        firing = self.firing
+        for neuron in touched:
+            value = nxt[neuron]
+            curr[neuron] = value
+            if self.can_fire[neuron] and abs(value) > self.threshold:
+                firing.add(neuron)
+            else:
+                firing.discard(neuron)
+        self.touched = set()
+
+    def motorcontrol_active(self):
+        """motorcontrol for the active engine, only muscles written to since the last step can be non-zero."""
+        nxt = self.next
+        side = self.side
+        self.accumleft = 0
+        self.accumright = 0
+        for neuron in self.touched & self.motor_ids:
+            if side[neuron] == 1:
+                self.accumleft += nxt[neuron]
+                nxt[neuron] = 0
+            elif side[neuron] == 2:
+                self.accumright += nxt[neuron]
+                nxt[neuron] = 0
+
+        if self.body is not None:
+            angle, mag = self.body.move(self.accumleft, self.accumright)
+
+    def stimulate_active(self, neurons):
+        nxt = self.next
+        for neuron in neurons:
+            dsts, ws = self.outputs[neuron]
+            for dst, w in zip(dsts, ws):
+                nxt[dst] += w
+            self.touched.update(dsts)
+
+    def accumulate_ids(self, dendrite):
+        """accumulate for the id based engines, which do it through stimulate."""
+        self.stimulate((self.index.id(dendrite),))
+
+    def named(self, values):
+        """curr or next as a {neuron: value} dict, whichever engine is in use."""
+        if self.engine == "dict":
+            return values
+        if self.engine == "fused":
+            # Muscles aren't kept, LEFT and RIGHT are zero after every step
+            return {self.neurons[i]: int(v) for i, v in zip(self.fused.cells.tolist(), values)}
+        return dict(zip(self.neurons, [int(v) for v in values]))
+
+
+    def state_vector(self, values, out=None):
+        """
+        curr or next as an int64 vector by neuron id, whichever engine is in use.
+        With out, it's written into out (e.g. a recorder's buffer) instead of a new vector.
+        """
+        if self.engine == "fused":
+            return self.fused.to_global(values, out)
+        if self.engine == "dict":
+            values = [values[neuron] for neuron in self.neurons]
+        if out is None:
+            return np.array(values, dtype=np.int64)
+        out[:] = values
+        return out
+
+    def state_vectors(self):
+        return self.state_vector(self.curr), self.state_vector(self.next)
+
+    def set_state_vectors(self, curr, next):
+        """Inverse of state_vectors"""
+        if self.engine == "dict":
+            self.curr = dict(zip(self.neurons, curr.tolist()))
+            self.next = dict(zip(self.neurons, next.tolist()))
+        elif self.engine == "csr":
+            np.copyto(self.curr, curr)
+            np.copyto(self.next, next)
+        elif self.engine == "fused":
+            self.curr = self.fused.from_global(curr)
+            self.next = self.fused.from_global(next)
+        elif self.engine == "active":
+            self.curr = curr.tolist()
+            self.next = next.tolist()
+            # Anything may be non-zero now, so have the next step look at everything
+            self.touched = set(range(len(self.next)))
+            self.firing_threshold = None
+
+    def snapshot(self, path):
+        """
+        Save everything needed to carry on from this point to path:
+            curr and next, the motor accumulators, threshold, timestep, the body's position and heading,
+            and the state of python's and numpy's global random generators.
+
+        It's an arrayfile (see arrayfile.py), with neuron state stored by neuron id, so a snapshot
+            taken with one engine can be restored into any other.
+        """
+        curr, next = self.state_vectors()
+        version, mt, gauss_next = random.getstate()
+        np_name, np_keys, np_pos, np_has_gauss, np_gauss = np.random.get_state()
+
+        arrays = {
+            "curr": curr,
+            "next": next,
+            "random_state": np.array(mt, dtype=np.uint32),
+            "np_random_keys": np_keys,
+        }
+        meta = {
+            "format": SNAPSHOT_FORMAT,
+            "engine": self.engine,
+            "names": self.neurons,
+            "timestep": self.timestep,
+            "threshold": self.threshold,
+            "accumleft": int(self.accumleft),
+            "accumright": int(self.accumright),
+            "body": self.body.snapshot() if self.body is not None else None,
+            "random": {"version": version, "gauss_next": gauss_next},
+            "np_random": {"name": np_name, "pos": np_pos, "has_gauss": np_has_gauss, "cached_gaussian": np_gauss},
+        }
+        arrayfile.save(path, arrays, meta)
+
+    def restore(self, path):
+        """
+        Load a snapshot() into this nematode, its body (if both have one) and the global random generators.
+        Running on from here does exactly what the snapshotted nematode would have.
+        """
+        arrays, meta = arrayfile.load(path, mmap=False)
+        if meta.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"{path} is not a format {SNAPSHOT_FORMAT} snapshot")
+        if meta["names"] != self.neurons:
+            raise ValueError(f"{path} was taken with different neurons")
+
+        self.set_state_vectors(arrays["curr"], arrays["next"])
+        self.timestep = meta["timestep"]
+        self.threshold = meta["threshold"]
+        self.accumleft = meta["accumleft"]
+        self.accumright = meta["accumright"]
+
+        if self.body is not None and meta["body"] is not None:
+            self.body.restore(meta["body"])
+
+        rand = meta["random"]
+        random.setstate((rand["version"], tuple(arrays["random_state"].tolist()), rand["gauss_next"]))
+        np_rand = meta["np_random"]
+        np.random.set_state((np_rand["name"], np.array(arrays["np_random_keys"]), np_rand["pos"],
+                             np_rand["has_gauss"], np_rand["cached_gaussian"]))
+
+    def start_trace(self, path, spikes=False, threaded=False, **kwargs):
+        """
+        Record every step from now on into a recorder.TraceWriter at path (kwargs go to it), until stop_trace().
+        With spikes, into a recorder.SpikeWriter instead, which keeps only what fired, the sensors triggered
+            and the motor values, plus a keyframe every so often, for much smaller files on long runs.
+        With threaded, the writer compresses and writes its chunks on a thread of its own (see pipeline.py),
+            so this one only copies each step into the writer's buffers.
+
+        Tracing wraps propagate_connectome and the sensor triggers (see hooks.py),
+            so a nematode that isn't traced runs exactly the same code as before, at no cost.
+        """
+        from recorder import TraceWriter, SpikeWriter, STIMULUS
+        if getattr(self, "tracer", None) is not None:
+            self.stop_trace()
+        if threaded:
+            from pipeline import Pipeline
+            kwargs["pipeline"] = Pipeline()
+        writer = SpikeWriter if spikes else TraceWriter
+        self.tracer = writer(path, self.neurons, meta={"engine": self.engine, "threshold": self.threshold}, **kwargs)
+        self.stimulus_bits = 0
+
+        def traced_trigger(bit):
+            def traced(trigger):
+                def trigger_traced():
+                    self.stimulus_bits |= bit
+                    trigger()
+                return trigger_traced
+            return traced
+
+        for group, bit in STIMULUS.items():
+            self.hooks.add("trace", self, f"trigger_{group}", traced_trigger(bit))
+
+        can_fire = self.compiled.can_fire
+
+        def traced(propagate):
+            def propagate_traced():
+                fired = can_fire & (np.abs(self.state_vector(self.curr)) > self.threshold)
+                propagate()
+                body = self.body
+                pose = (*body.pos(), body.heading()) if body is not None else None
+                tracer = self.tracer
+                # Straight into the writer's buffer, rather than into a vector of our own for it to copy
+                self.state_vector(self.curr, tracer.state_buffer())
+                tracer.record(self.timestep, None, fired, self.accumleft, self.accumright, pose, self.stimulus_bits)
+                self.stimulus_bits = 0
+            return propagate_traced
+
+        def keyframe():
+            self.tracer.keyframe(*self.state_vectors(), self.body.snapshot() if self.body is not None else None,
+                                 {"threshold": self.threshold, "accumleft": self.accumleft, "accumright": self.accumright})
+
+        def spiked(propagate):
+            def propagate_spikes():
+                fired = can_fire & (np.abs(self.state_vector(self.curr)) > self.threshold)
+                propagate()
+                self.tracer.record(self.timestep, fired, self.accumleft, self.accumright, self.stimulus_bits)
+                self.stimulus_bits = 0
+                # Keyframes go between steps, so that they don't include the next step's stimulus
+                if self.tracer.keyframe_due:
+                    keyframe()
+            return propagate_spikes
+
+        if spikes:
+            keyframe()
+            self.hooks.add("trace", self, "propagate_connectome", spiked)
+        else:
+            self.hooks.add("trace", self, "propagate_connectome", traced)
+
+    def stop_trace(self):
+        """Write out and close the trace, and take the tracing wrappers off."""
+        if getattr(self, "tracer", None) is None:
+            return
+        self.tracer.close()
+        self.tracer = None
+        self.hooks.remove("trace")
+
+    def start_timing(self, report_every=0, window=10000):
+        """
+        Time each phase of main from now on with a timing.PhaseTimer, until stop_timing():
+            sense (body.nose_touching, environment.food_sensed), stimulus (trigger_*), propagate, motor,
+            move (body.move) and render (clear, pencolor, cagecolor, and draw, which body.move calls to
+            update the screen).
+        Like tracing, this wraps those (see hooks.py), so nothing is timed, at no cost, unless this is called.
+
+        :param report_every: also print a rolling report to stderr every this many steps, if not 0
+        :return: the PhaseTimer, whose report() is printed by stop_timing()
+        """
+        from timing import PhaseTimer
+        if getattr(self, "timer", None) is not None:
+            self.stop_timing()
+        timer = self.timer = PhaseTimer(window)
+
+        # (object, method name, phase) to time, on the nematode, its body and environment
+        timed = [(self, "propagate_connectome", "propagate"), (self, "motorcontrol", "motor")]
+        timed += [(self, f"trigger_{group}", "stimulus")
+                  for group in ("food_sensors", "nose_touch_sensors", "anterior_harsh_touch_sensors")]
+        timed += [(self.environment, "food_sensed", "sense")]
+        if self.body is not None:
+            timed += [(self.body, "nose_touching", "sense"), (self.body, "move", "move")]
+            timed += [(self.body, name, "render") for name in ("clear", "pencolor", "cagecolor", "draw")
+                      if hasattr(self.body, name)]
+
+        for obj, name, phase in timed:
+            self.hooks.add("timing", obj, name, functools.partial(timer.wrap, phase))
+
+        if report_every:
+            steps = timer.phase("propagate")
+
+            def reported(propagate):
+                def propagate_reported():
+                    propagate()
+                    if steps.calls % report_every == 0:
+                        print(timer.report(rolling=True), file=sys.stderr)
+                return propagate_reported
+
+            self.hooks.add("timing", self, "propagate_connectome", reported)
+        return timer
+
+    def stop_timing(self):
+        """Print the timing report to stderr, and take the timing wrappers off."""
+        if getattr(self, "timer", None) is None:
+            return
+        print(self.timer.report(), file=sys.stderr)
+        self.timer = None
+        self.hooks.remove("timing")
+
+    def start_profile(self):
+        """
+        Count each neuron's firings and stimulations from now on, and so each synapse's weight additions,
+            in a profiler.ActivityProfiler, until stop_profile().
+        Like tracing, this wraps propagate_connectome and stimulate (see hooks.py), at no cost without it.
+
+        :return: the ActivityProfiler
+        """
+        from profiler import ActivityProfiler
+        if getattr(self, "profiler", None) is not None:
+            self.stop_profile()
+        profiler = self.profiler = ActivityProfiler(self.compiled)
+
+        can_fire = self.compiled.can_fire
+
+        def profiled_propagate(propagate):
+            def propagate_profiled():
+                profiler.record_fired(can_fire & (np.abs(self.state_vector(self.curr)) > self.threshold))
+                propagate()
+            return propagate_profiled
+
+        def profiled_stimulate(stimulate):
+            def stimulate_profiled(neurons):
+                profiler.record_stimulus(neurons)
+                stimulate(neurons)
+            return stimulate_profiled
+
+        self.hooks.add("profile", self, "propagate_connectome", profiled_propagate)
+        self.hooks.add("profile", self, "stimulate", profiled_stimulate)
+        return profiler
+
+    def stop_profile(self):
+        """Take the profiling wrappers off. :return: the ActivityProfiler, or None if we weren't profiling"""
+        profiler = getattr(self, "profiler", None)
+        if profiler is None:
+            return None
+        self.profiler = None
+        self.hooks.remove("profile")
+        return profiler
+
+    def add_probe(self, neuron, callback, start=0, stop=None, condition=None):
+        """
+        Call callback with a probes.ProbeHit for neuron after every step with start <= timestep < stop
+            (stop None for no end), for which condition(hit) holds if given. See probes.py.
+        The first probe wraps propagate_connectome (see hooks.py), and removing the last takes that off,
+            so without probes the step doesn't check for any.
+
+        :return: the probes.Probe, to remove_probe() with
+        """
+        from probes import Probe, Probes
+        # Before anything else, so an unknown neuron leaves us as we were
+        probe = Probe(neuron, callback, start, stop, condition, self.index.id(neuron))
+        if getattr(self, "probes", None) is None:
+            probes = self.probes = Probes(self.compiled)
+
+            def probed(propagate):
+                def propagate_probed():
+                    active = probes.active(self.timestep)
+                    if not active:
+                        return propagate()
+                    curr = self.state_vector(self.curr)
+                    propagate()
+                    probes.check(active, self.timestep, self.threshold, curr, self.state_vector(self.curr))
+                return propagate_probed
+
+            self.hooks.add("probes", self, "propagate_connectome", probed)
+        return self.probes.add(probe)
+
+    def remove_probe(self, probe):
+        self.probes.remove(probe)
+        if not self.probes:
+            self.probes = None
+            self.hooks.remove("probes")
+
+    def fork(self, n):
+        """
+        n copies of this nematode as of now, to run on with different stimuli, thresholds or weights.
+
+        :return: (brains, bodies): a batch.NematodeBatch of n worms starting from this brain's state, sharing
+            its connectome and (until they step) that state, copy-on-write, and a kinematics.BodyBatch of n bodies
+            where our body is, or None without a body.
+            Forked with fork start method processes also share these pages, until written.
+        """
+        from batch import NematodeBatch
+        from kinematics import BodyBatch
+
+        curr, next = self.state_vectors()
+        curr.flags.writeable = False
+        next.flags.writeable = False
+        brains = NematodeBatch(n, threshold=self.threshold, compiled=self.compiled,
+                               curr=curr, next=next, timestep=self.timestep)
+        bodies = BodyBatch.from_snapshot(n, self.body.snapshot()) if self.body is not None else None
+        return brains, bodies
 
 
     def trigger_food_sensors(self):
@@ -683,10 +802,8 @@ class Nematode:
         # self.accumulate("ASJL")
         # self.accumulate("ASJR")
         #
-        self.accumulate("AWCL")
-        self.accumulate("AWCR")
-        self.accumulate("AWAL")
-        self.accumulate("AWAR")
+        # AWCL, AWCR, AWAL, AWAR
+        self.stimulate(self.index.food_sensors)
 
     def trigger_nose_touch_sensors(self):
 
@@ -701,58 +818,80 @@ class Nematode:
         # self.accumulate("OLQVR")
         # self.accumulate("OLQVL")
 
-        self.accumulate("FLPL")
-        self.accumulate("FLPR")
-        self.accumulate("BDUL")
-        self.accumulate("BDUR")
-        self.accumulate("SDQL")
-        self.accumulate("SDQR")
+        # FLPL, FLPR, BDUL, BDUR, SDQL, SDQR
+        self.stimulate(self.index.nose_touch_sensors)
+
     def trigger_anterior_harsh_touch_sensors(self):
         #untested, unused
-        self.accumulate("FLPL")
-        self.accumulate("FLPR")
-        self.accumulate("BDUL")
-        self.accumulate("BDUR")
-        self.accumulate("SDQR")
-
-    def main(self):
-        timestep_n = 5000000000000000000
+        # FLPL, FLPR, BDUL, BDUR, SDQR
+        self.stimulate(self.index.anterior_harsh_touch_sensors)
+
+    def main(self, snapshot_path=None, snapshot_every=0, steps=None):
+        """
+        Run the nematode in its environment until interrupted, from self.timestep (so after restore() it resumes).
+
+        :param snapshot_path: where to write a snapshot() every snapshot_every timesteps, if both are given.
+        :param steps: how many timesteps to run for, None for until interrupted.
+        """
+        body = self.body
+        events = self.verbosity >= 1
+        scheduler = self.scheduler
+        substeps = scheduler.substeps if scheduler is not None else 1
+        if substeps > 1:
+            # The brain runs substeps timesteps a tick, but the body only moves once a tick, by all of them
+            moved = [0, 0]
+
+            def summed(move):
+                def move_summed(left, right):
+                    moved[0] += left
+                    moved[1] += right
+                    if (self.timestep + 1) % substeps:
+                        return 0, 0
+                    left, right = moved
+                    moved[:] = [0, 0]
+                    return move(left, right)
+                return move_summed
+
+            self.hooks.add("substeps", body, "move", summed)
+        if scheduler is not None:
+            scheduler.start()
+        logger.info("Starting at timestep %d with the %s engine", self.timestep, self.engine)
+        timestep_n = 5000000000000000000 if steps is None else self.timestep + steps
         #timestep_n = 100000
-        food_x = 750
-        food_y = 0
-        food_r = 200
         #while timestep < timestep_n if timestep_n > 0 else True:
-        self.timestep = 0
-        for self.timestep in tqdm(range(timestep_n)):
+        for self.timestep in tqdm(range(self.timestep, timestep_n)):
+            if snapshot_every and snapshot_path is not None and self.timestep % snapshot_every == 0:
+                self.snapshot(snapshot_path)
+
             #print(f"TIMESTEP: {timestep}")
-            if self.timestep % 6000 == 0:
-                body.clear()
+            # No more clearing the drawing every 6000 steps to keep Tk fast, the body's trail is bounded, see trail.py
 
             if self.timestep <= 100:
                 #print(self.curr["VD10"], self.next["VD10"], self.curr["VD9"], self.next["VD9"])
                 pass
-            if self.timestep == 998:
-                with open("/home/blue/temp-next.txt", "w") as f:
-                    for key, value in sorted(self.curr.items()):
-                        f.write(f"{key}:{value}\n")
-                return
             #turtle.update()
 
 
+            if substeps > 1 and self.timestep % substeps:
+                # Between the scheduler's ticks the brain runs on without sensing, and the body waits for the tick's end
+                self.propagate_connectome()
             # Check if it is bumping into the wall, and if so, trigger nose touch
-            if body.nose_touching():
+            elif body.nose_touching():
                 body.cagecolor("black")
                 body.pencolor("black")
+                if events:
+                    logger.log(EVENT, "%d nose touching at %s", self.timestep, body.pos())
                 self.trigger_nose_touch_sensors()
                 #self.runconnectome()
                 self.propagate_connectome()
             else:
                 # Otherwise do nothing, unless we encounter food
                 # todo we need to handle case where its on the wall and there's food
-                #if self.timestep < 15 or body.distance(food_x,food_y) < food_r:
-                if self.timestep < 15:
+                if self.environment.food_sensed(body, self.timestep):
                     body.cagecolor("red")
                     body.pencolor("red")
+                    if events:
+                        logger.log(EVENT, "%d food sensed at %s", self.timestep, body.pos())
                     self.trigger_food_sensors()
                     self.propagate_connectome()
                     #self.runconnectome()
@@ -762,18 +901,102 @@ class Nematode:
                     # no food sensors, but still run the brain
                     #self.runconnectome()
                     self.propagate_connectome()
-            if self.time_delays:
-                time.sleep(0.1)
+            if scheduler is not None and (self.timestep + 1) % substeps == 0:
+                scheduler.tick()
+        self.hooks.remove("substeps")
 
         body.exit()
 
-        print(np.mean(body.lefts))
-        print(np.mean(body.rights))
-        print(np.mean(body.rights)-np.mean(body.lefts))
+        logger.info("Mean left %s, right %s, right - left %s", np.mean(body.lefts), np.mean(body.rights),
+                    np.mean(body.rights)-np.mean(body.lefts))
 
 def main():
-    nematode = Nematode()
-    nematode.main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-v', '--verbose', action='count', default=0)
+    # three levels of verbosity: [], -v, -vv, see log.py
+    # 0: only log starting and exiting messages
+    # 1: also log when obstacles/food found
+    # 2: also log left and right every time
+    parser.add_argument('--log', metavar='PATH', help="Log to PATH instead of stderr")
+    parser.add_argument('--engine', choices=ENGINES, default="dict")
+    parser.add_argument('--headless', action='store_true', help="Move a kinematics.HeadlessBody, no turtle window")
+    parser.add_argument('--rate', metavar='RATE',
+                        help="Run in real time, at e.g. 10hz ticks, 1x real time or max, see scheduler.py")
+    parser.add_argument('--substeps', metavar='N', type=int, default=1,
+                        help="Timesteps per tick with --rate, only the first senses and the body moves once at the end")
+    parser.add_argument('--render', metavar='FPS', type=int, nargs='?', const=30,
+                        help="Draw the body from another process at FPS frames a second, see render.py")
+    parser.add_argument('--restore', metavar='PATH', help="Resume from a snapshot")
+    parser.add_argument('--snapshot', metavar='PATH', help="Where to snapshot to, see --snapshot-every")
+    parser.add_argument('--snapshot-every', metavar='N', type=int, default=10000)
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument('--trace', metavar='PATH', help="Record every step to a trace, see recorder.py")
+    recording.add_argument('--spikes', metavar='PATH', help="Record every step to a spike log, see recorder.py")
+    parser.add_argument('--threaded', action='store_true',
+                        help="Write the trace or spike log from another thread, see pipeline.py")
+    parser.add_argument('--timings', metavar='N', type=int, nargs='?', const=0,
+                        help="Time each phase of the loop and report at exit, and every N steps if given")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="Count firings per neuron and additions per synapse, written to PATH as JSON at exit")
+    parser.add_argument('--probe', metavar='NEURON[:START[:STOP]]', action='append', default=[],
+                        help="Print a neuron's value, and what fired into it, every step from START until STOP")
+    args = parser.parse_args()
+    if args.substeps < 1:
+        parser.error("--substeps must be at least 1")
+    if args.substeps != 1 and not args.rate:
+        parser.error("--substeps only applies with --rate")
+    if args.threaded and not (args.trace or args.spikes):
+        parser.error("--threaded only applies with --trace or --spikes")
+    listener = start_logging(args.verbose, args.log)
+
+    renderer = None
+    if args.headless:
+        from kinematics import HeadlessBody
+        body = HeadlessBody()
+    elif args.render:
+        from render import PoseRing, RenderedBody, start_renderer
+        body = RenderedBody(PoseRing())
+        renderer = start_renderer(body.ring, fps=args.render)
+    else:
+        # Only now, since this opens the turtle window
+        from body import Body
+        body = Body()
+    nematode = Nematode(engine=args.engine, body=body, environment=Environment(), verbosity=args.verbose)
+    if args.restore:
+        nematode.restore(args.restore)
+    if args.rate:
+        from scheduler import RealtimeScheduler
+        nematode.scheduler = RealtimeScheduler.parse(args.rate, args.substeps)
+    if args.trace:
+        nematode.start_trace(args.trace, threaded=args.threaded)
+    elif args.spikes:
+        nematode.start_trace(args.spikes, spikes=True, threaded=args.threaded)
+    for spec in args.probe:
+        neuron, start, stop = (spec.split(":") + ["", ""])[:3]
+        nematode.add_probe(neuron, lambda hit: print(hit, hit.inputs(), file=sys.stderr),
+                           start=int(start or 0), stop=int(stop) if stop else None)
+    if args.profile:
+        nematode.start_profile()
+    if args.timings is not None:
+        nematode.start_timing(report_every=args.timings)
+    try:
+        nematode.main(snapshot_path=args.snapshot, snapshot_every=args.snapshot_every)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        nematode.stop_timing()
+        profiler = nematode.stop_profile()
+        if profiler is not None:
+            profiler.export(args.profile)
+            print(profiler.summary(), file=sys.stderr)
+        nematode.stop_trace()
+        logger.info("Stopped at timestep %d", nematode.timestep)
+        if nematode.scheduler is not None:
+            logger.info("%s", nematode.scheduler.report())
+        if renderer is not None:
+            body.ring.close()
+            renderer.join()
+        stop_logging(listener)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,343 @@
+"""
+Array engine for the connectome.
+
+The dict engine in connectome.py walks every neuron name, and every (dst, weight) tuple of every neuron that fires,
+    one python dict update at a time.
+Here we compile neurons.txt once into integer-indexed CSR arrays, so that a timestep is just a thresholded mask
+    over a numpy state vector plus one sparse mat-vec.
+"""
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+import arrayfile
+from log import logger
+from neurons import NeuronIndex
+
+# The connectome file, next to this module so runs from any directory find it
+NEURONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "neurons.txt")
+
+
+class CSRMatrix:
+    """
+    Minimal integer CSR matrix with plain numpy, usually built from (row, col, value) triplets with from_triplets.
+
+    matvec sums each row's products with np.add.reduceat, which is only defined for non-empty rows,
+        so we keep those row numbers and where they start.
+    """
+    def __init__(self, indptr, indices, data, nonempty=None, starts=None):
+        self.n_rows = len(indptr) - 1
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+        self.nonempty = np.flatnonzero(np.diff(indptr)) if nonempty is None else nonempty
+        self.starts = indptr[self.nonempty] if starts is None else starts
+
+    @classmethod
+    def from_triplets(cls, rows, cols, vals, n_rows):
+        order = np.argsort(rows, kind="stable")
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+        return cls(indptr, np.asarray(cols, dtype=np.int64)[order], np.asarray(vals, dtype=np.int64)[order])
+
+    def arrays(self):
+        return {"indptr": self.indptr, "indices": self.indices, "data": self.data,
+                "nonempty": self.nonempty, "starts": self.starts}
+
+    def row(self, i):
+        a, b = self.indptr[i], self.indptr[i + 1]
+        return self.indices[a:b], self.data[a:b]
+
+    def matvec(self, x):
+        """
+        y = A @ x. Integer (or boolean) x gives exact integer y.
+
+        x may also be 2D, (batch, n), in which case every row is multiplied at once and y is (batch, n_rows).
+        """
+        products = np.take(x, self.indices, axis=-1) * self.data
+        y = np.zeros(x.shape[:-1] + (self.n_rows,), dtype=products.dtype)
+        if not self.starts.size:
+            return y
+        sums = np.add.reduceat(products, self.starts, axis=-1)
+        if x.ndim == 1:
+            y[self.nonempty] = sums
+        else:
+            y[:, self.nonempty] = sums
+        return y
+
+
+class MotorReadout:
+    """
+    Reads the left and right motor totals out of a state, as a 2 x n readout matrix, and resets the muscles read.
+
+    Works the same on one state vector or an (n_worms, n) batch of them.
+    """
+    def __init__(self, index):
+        self.matrix = np.zeros((2, len(index)), dtype=np.int64)
+        self.matrix[0, index.left_muscles] = 1
+        self.matrix[1, index.right_muscles] = 1
+        self.muscles = self.matrix.any(axis=0)
+
+    def read(self, state):
+        """
+        :return: (left, right) totals of state, as ints for a vector or (n_worms,) arrays for a batch.
+            The muscles of state are zeroed.
+        """
+        left, right = self.matrix @ state.T
+        np.copyto(state, 0, where=self.muscles)
+        return left, right
+
+
+def propagation_matrices(src, dst, w, n):
+    """The outputs and inputs CSR matrices of CompiledConnectome, for an edge list over n ids."""
+    outputs = CSRMatrix.from_triplets(src, dst, w, n)
+    later = src > dst
+    inputs = CSRMatrix.from_triplets(np.concatenate([dst, dst[later] + n]),
+                                     np.concatenate([src, src[later]]),
+                                     np.concatenate([w, w[later]]), 2 * n)
+    return outputs, inputs
+
+
+class CompiledConnectome:
+    """
+    The connectome as integer arrays, with neuron ids from the given NeuronIndex.
+
+    Two CSR layouts of the same edges are kept:
+        outputs: source-major, to add one neuron's outputs into a state vector (sensor stimulation)
+        inputs: destination-major, so propagation is a mat-vec over the vector of fired neurons.
+
+    The order of the ids matters - the dict engine fires neurons in that order, and each one
+        zeroes itself after firing, wiping whatever neurons before it sent it, but not what neurons after it send.
+    So the inputs matrix has 2n rows, the first n hold every edge and the last n only the edges coming
+        from a later neuron than their destination. See propagate().
+    """
+    def __init__(self, index, src, dst, w, outputs=None, inputs=None):
+        self.index = index
+        self.n = n = len(index)
+
+        # Edge list, in the order they were read
+        self.src = np.asarray(src, dtype=np.int64)
+        self.dst = np.asarray(dst, dtype=np.int64)
+        self.w = np.asarray(w, dtype=np.int64)
+
+        self.can_fire = ~index.muscle
+
+        if outputs is None or inputs is None:
+            outputs, inputs = propagation_matrices(self.src, self.dst, self.w, n)
+        self.outputs = outputs
+        self.inputs = inputs
+        self._dense_inputs = None
+
+    @classmethod
+    def from_file(cls, path=NEURONS_FILE, index=None):
+        """Read a "src dst weight" per line connectome file, such as neurons.txt"""
+        if index is None:
+            index = NeuronIndex()
+        ids = index.ids
+        src, dst, w = [], [], []
+        with open(path, "r") as f:
+            for line in f:
+                s, d, weight = line.strip().split(" ")
+                src.append(ids[s])
+                dst.append(ids[d])
+                w.append(int(weight))
+        return cls(index, src, dst, w)
+
+    @classmethod
+    def load(cls, path=NEURONS_FILE, index=None, cache=True):
+        """
+        from_file, through a compiled binary cache next to path.
+
+        The cache is named after a hash of path's contents and the neuron names (which decide the ids),
+            so editing either just makes a new one. Later loads memory map it instead of parsing anything,
+            which also lets every process of a sweep share the same physical pages.
+        If the cache can't be written we carry on without it, and if it can't be read (e.g. a run was killed
+            while writing it) we rebuild it.
+        """
+        if index is None:
+            index = NeuronIndex()
+        if not cache:
+            return cls.from_file(path, index)
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            digest.update(f.read())
+        digest.update("\n".join(index.names).encode())
+        cache_path = f"{path}.{digest.hexdigest()[:16]}.cache"
+
+        if os.path.exists(cache_path):
+            try:
+                arrays, meta = arrayfile.load(cache_path)
+            except (ValueError, OSError) as e:
+                logger.warning("Rebuilding unreadable connectome cache %s: %s", cache_path, e)
+            else:
+                if meta["names"] == index.names:
+                    return cls.from_arrays(index, arrays)
+
+        compiled = cls.from_file(path, index)
+        try:
+            arrayfile.save(cache_path, compiled.arrays(), {"names": index.names})
+        except OSError:
+            return compiled
+        # Old caches of this file are stale now
+        for old in glob.glob(f"{glob.escape(path)}.*.cache"):
+            if old != cache_path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        return compiled
+
+    def arrays(self):
+        """Everything needed to rebuild this with from_arrays, as {name: array}."""
+        arrays = {"src": self.src, "dst": self.dst, "w": self.w}
+        for prefix, matrix in (("outputs", self.outputs), ("inputs", self.inputs)):
+            for name, a in matrix.arrays().items():
+                arrays[f"{prefix}_{name}"] = a
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, index, arrays):
+        matrices = {}
+        for prefix in ("outputs", "inputs"):
+            matrices[prefix] = CSRMatrix(*(arrays[f"{prefix}_{name}"]
+                                           for name in ("indptr", "indices", "data", "nonempty", "starts")))
+        return cls(index, arrays["src"], arrays["dst"], arrays["w"], **matrices)
+
+    def with_weights(self, src, dst, w):
+        """
+        A copy with the total weight from each src[i] to dst[i] set to w[i], adding edges that don't exist yet
+            and removing ones set to 0. This connectome is left as is, and shares the index.
+        """
+        n = self.n
+        src, dst, w = (np.atleast_1d(np.asarray(a, dtype=np.int64)) for a in (src, dst, w))
+        # Last one wins for repeated pairs
+        new = dict(zip((src * n + dst).tolist(), w.tolist()))
+        keys = np.fromiter(new, dtype=np.int64, count=len(new))
+        weights = np.fromiter(new.values(), dtype=np.int64, count=len(new))
+
+        keep = ~np.isin(self.src * n + self.dst, keys)
+        add = weights != 0
+        return CompiledConnectome(self.index,
+                                  np.concatenate([self.src[keep], keys[add] // n]),
+                                  np.concatenate([self.dst[keep], keys[add] % n]),
+                                  np.concatenate([self.w[keep], weights[add]]))
+
+    def dense_inputs(self):
+        """
+        The inputs matrix, transposed and dense, so that fired @ dense_inputs() == inputs.matvec(fired).
+
+        For batches of worms a BLAS matmul against this beats the sparse gather.
+        It's float32 when that is still exact, i.e. all the absolute weights sum below 2**24, else float64.
+        """
+        if self._dense_inputs is None:
+            A = self.inputs
+            rows = np.repeat(np.arange(A.n_rows), np.diff(A.indptr))
+            dtype = np.float32 if np.abs(A.data).sum() < 2**24 else np.float64
+            dense = np.zeros((self.n, A.n_rows), dtype=dtype)
+            np.add.at(dense, (A.indices, rows), A.data)
+            self._dense_inputs = dense
+        return self._dense_inputs
+
+    def zeros(self):
+        return np.zeros(self.n, dtype=np.int64)
+
+    def stimulate(self, state, neuron):
+        """Add the outputs of the given neuron id to state, without firing (or zeroing) it."""
+        dst, w = self.outputs.row(neuron)
+        np.add.at(state, dst, w)
+
+    def adjacency(self):
+        """Outputs of every neuron id as python ([dst], [w]) lists, for engines that walk edges one at a time."""
+        return [tuple(a.tolist() for a in self.outputs.row(i)) for i in range(self.n)]
+
+    def stimulus(self, neurons):
+        """Everything the given neuron ids send out, as one vector to add onto a state when stimulating all of them."""
+        state = self.zeros()
+        for neuron in neurons:
+            self.stimulate(state, neuron)
+        return state
+
+    def propagate(self, curr, next, threshold):
+        """
+        Step one timestep forward in place on next, given the curr snapshot. Returns the mask of neurons fired.
+
+        Equivalent to firing, in order, every non-muscle neuron of curr above threshold:
+            next[dst] += w for each of its outputs, then next[neuron] = 0.
+        So a fired neuron ends up holding only what later fired neurons sent it, which is the second half of the mat-vec.
+        """
+        fired = self.can_fire & (np.abs(curr) > threshold)
+        y = self.inputs.matvec(fired)
+        np.add(next, y[:self.n], out=next)
+        np.copyto(next, y[self.n:], where=fired)
+        return fired
+
+
+class FusedConnectome(CompiledConnectome):
+    """
+    A CompiledConnectome with its muscles folded into two motor accumulators.
+
+    Muscles never fire, and all motorcontrol does with them is sum the left ones and the right ones and zero them.
+    So instead of a state entry per muscle we keep one per non-muscle neuron ("cells"), plus LEFT and RIGHT
+        entries at the end, with every edge into a left muscle redirected into LEFT and likewise for right.
+        That's the readout matrix precomposed with the muscle columns of the connectome.
+    Firing then projects straight into the motor accumulators, within the same mat-vec as the rest of propagation,
+        and muscle state is never materialized. Muscles in neither group (MVULVA) are never read, so they're dropped.
+
+    Ids here are local: state[i] is neuron cells[i], state[m] is LEFT and state[m + 1] is RIGHT.
+    stimulate() still takes global ids.
+    """
+    def __init__(self, compiled):
+        index = compiled.index
+        self.index = index
+        self.cells = np.flatnonzero(~index.muscle)
+        self.m = m = len(self.cells)
+        self.n = n = m + 2
+
+        # Global id -> local id, -1 for the dropped muscles
+        self.local = np.full(len(index), -1, dtype=np.int64)
+        self.local[self.cells] = np.arange(m)
+        self.local[index.left_muscles] = m
+        self.local[index.right_muscles] = m + 1
+
+        src, dst = self.local[compiled.src], self.local[compiled.dst]
+        keep = (src >= 0) & (dst >= 0)
+        self.src, self.dst, self.w = src[keep], dst[keep], np.asarray(compiled.w)[keep]
+
+        self.can_fire = np.arange(n) < m
+        self.outputs, self.inputs = propagation_matrices(self.src, self.dst, self.w, n)
+        self._dense_inputs = None
+
+    def stimulate(self, state, neuron):
+        super().stimulate(state, self.local[neuron])
+
+    def to_global(self, state, out=None):
+        """
+        A local state as a vector over every global id. LEFT and RIGHT go into the first left and right muscle,
+            which reads out the same, and from_global() takes back to the same local state.
+        With out, it's written into out instead of a new vector.
+        """
+        if out is None:
+            out = np.zeros(len(self.index), dtype=state.dtype)
+        else:
+            out.fill(0)
+        out[self.cells] = state[:self.m]
+        out[self.index.left_muscles[0]] = state[self.m]
+        out[self.index.right_muscles[0]] = state[self.m + 1]
+        return out
+
+    def from_global(self, state):
+        """A vector over every global id as a local state, summing the muscles into LEFT and RIGHT."""
+        out = self.zeros()
+        keep = self.local >= 0
+        np.add.at(out, self.local[keep], state[keep])
+        return out
+
+    def read_motors(self, state):
+        """(left, right) accumulated in state, zeroing them."""
+        left, right = state[self.m:].tolist()
+        state[self.m:] = 0
+        return left, right
@@ -0,0 +1,26 @@
+"""
+The world around the nematode, apart from the cage walls its body already senses.
+
+Kept separate from the body, so the same environment can be given to a turtle body or a headless one.
+"""
+
+
+class Environment:
+    """
+    Where there's food, and when the nematode smells it.
+
+    Food is sensed for the first food_steps timesteps, to get it moving,
+        and, if food is given as (x, y, radius), whenever its body is within radius of (x, y).
+        Nematode.main used to have that commented out with food at (750, 0, 200).
+    """
+    def __init__(self, food_steps=15, food=None):
+        self.food_steps = food_steps
+        self.food = food
+
+    def food_sensed(self, body, timestep):
+        if timestep < self.food_steps:
+            return True
+        if self.food is None:
+            return False
+        food_x, food_y, food_r = self.food
+        return body.distance(food_x, food_y) < food_r
@@ -0,0 +1,50 @@
+"""
+Wrapping methods for the optional features of a run, like tracing, timing, profiling and probes.
+
+Each of those works by wrapping a few methods, e.g. propagate_connectome, so a run without them runs the plain
+    methods at no cost. They all do it through one Hooks (Nematode.hooks), which keeps each method's wrappers
+    in a list in the order they were added, and sets the method to the chain of them over the original one.
+Taking a feature's wrappers off rebuilds the chains without them, so features can be started and stopped
+    in any order without dropping each other's wrappers, and the last one off puts the original back.
+"""
+
+
+class Hooks:
+    def __init__(self):
+        # (id(obj), name): (obj, the method before any wrappers or None where it's the class's own, [(feature, wrap)])
+        self.chains = {}
+
+    def add(self, feature, obj, name, wrap):
+        """
+        Wrap obj.name for feature, as wrap(method) -> wrapped method, outside any wrappers added before it.
+        wrap is called again whenever the chain is rebuilt, so any state the wrapped method keeps
+            has to live outside wrap.
+        """
+        key = (id(obj), name)
+        if key not in self.chains:
+            self.chains[key] = (obj, obj.__dict__.get(name), [])
+        self.chains[key][2].append((feature, wrap))
+        self._build(key)
+
+    def remove(self, feature):
+        """Take off all of feature's wrappers."""
+        for key, (obj, original, wraps) in list(self.chains.items()):
+            kept = [(f, wrap) for f, wrap in wraps if f != feature]
+            if len(kept) != len(wraps):
+                wraps[:] = kept
+                self._build(key)
+
+    def _build(self, key):
+        obj, original, wraps = self.chains[key]
+        name = key[1]
+        if original is None:
+            obj.__dict__.pop(name, None)
+        else:
+            setattr(obj, name, original)
+        if not wraps:
+            del self.chains[key]
+            return
+        method = getattr(obj, name)
+        for _, wrap in wraps:
+            method = wrap(method)
+        setattr(obj, name, method)
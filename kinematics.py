@@ -0,0 +1,212 @@
+"""
+Nematode body movement without turtle.
+
+body.Body is a turtle.Turtle, so every move goes through Tk even when nobody is watching.
+HeadlessBody does the same math on plain floats, in the same order turtle does it, so it follows the same
+    trajectory, and BodyBatch does it for n bodies at once with numpy.
+
+The cage and movement settings live here, body.py takes them from us.
+"""
+import math
+
+import numpy as np
+
+w = 3000
+h = 3000
+
+# Size of cage
+vw = w // 2
+vh = h // 2
+
+# "Actual" drawn size of cage
+cw = vw // 2
+ch = vh // 2
+
+# Upper bounds for movements on a given timestep
+# set to 512 to disable normalization
+max_mag = 5
+#max_angle = 36  # So we move 10% of a full rotation at most
+#max_angle = 720 # Since this empirically is very small
+max_angle = 512
+#max_angle = 720 # Since this empirically is very small
+
+wall_buffer = 20
+
+# Set to 360 to disable heading checking entirely
+#heading_buffer = 45
+heading_buffer = 360
+
+#Determined by running for 100k timesteps and getting average difference between left and right power
+left_trim = .56474
+right_trim = 0
+
+
+def normalize(angle, mag):
+    """See Body.normalize"""
+    return (angle / 512.) * max_angle, (mag / 512.) * max_mag
+
+
+def nose_touching(pos_x, pos_y, heading):
+    """
+    See Body.nose_touching. Works on floats, or elementwise on arrays of positions and headings.
+    """
+    # For my own convenience I set x1,y1 to bot-left corner and x2,y2 to top-right
+    x1, y1, x2, y2 = -cw, -ch, cw, ch
+    dist_2d = lambda x1, x2: abs(x1 - x2)
+
+    # right wall, 315deg - 45deg centered on 0deg or 360deg
+    # have to compare both 0 and 360 since circles
+    right = (dist_2d(pos_x, x2) < wall_buffer) & (dist_2d(heading, 0) < heading_buffer) & (dist_2d(heading, 360) < heading_buffer)
+    # top wall, 45deg - 135deg centered on 90deg
+    top = (dist_2d(pos_y, y2) < wall_buffer) & (dist_2d(heading, 90) < heading_buffer)
+    # left wall, 135deg - 225deg centered on 180deg
+    left = (dist_2d(pos_x, x1) < wall_buffer) & (dist_2d(heading, 180) < heading_buffer)
+    # bottom wall, 225deg - 315deg centered on 270deg
+    bottom = (dist_2d(pos_y, y1) < wall_buffer) & (dist_2d(heading, 270) < heading_buffer)
+    return right | top | left | bottom
+
+
+class HeadlessBody:
+    """
+    Body, minus turtle. Same move(left, right), nose_touching(), trims and cage clamping.
+
+    Position is (x, y) and heading is kept like turtle keeps it, as a unit vector (ox, oy),
+        since rotating that the way turtle.Vec2D does is what keeps us on turtle's trajectory.
+    The drawing methods Nematode.main calls (clear, pencolor, cagecolor, exit) do nothing.
+    """
+    def __init__(self, x=0.0, y=0.0, heading=0.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.ox, self.oy = math.cos(math.radians(heading)), math.sin(math.radians(heading))
+
+        self.sense_cage = True
+        self.enforce_cage = True
+
+        self.left_trim = left_trim
+        self.right_trim = right_trim
+
+        self.lefts = []
+        self.rights = []
+
+    def pos(self):
+        return self.x, self.y
+
+    def heading(self):
+        """Heading in degrees [0, 360), computed as turtle does."""
+        return round(math.degrees(math.atan2(self.oy, self.ox)), 10) % 360.0
+
+    def distance(self, x, y):
+        return math.hypot(x - self.x, y - self.y)
+
+    def normalize(self, angle, mag):
+        return normalize(angle, mag)
+
+    def nose_touching(self):
+        if not self.sense_cage: return False
+        return nose_touching(self.x, self.y, self.heading())
+
+    def move(self, left, right):
+        """See Body.move"""
+        left += self.left_trim
+        right += self.right_trim
+
+        angle = max(left, right) - min(left, right)
+        mag = left + right
+        angle, mag = self.normalize(angle, mag)
+
+        # Rotate first, counterclockwise (left) if there's more power in the right.
+        # This is turtle.Vec2D.rotate
+        turn = math.radians(angle if left < right else -angle)
+        c, s = math.cos(turn), math.sin(turn)
+        self.ox, self.oy = self.ox * c - self.oy * s, self.oy * c + self.ox * s
+
+        # Move next
+        self.x, self.y = self.x + self.ox * mag, self.y + self.oy * mag
+
+        if self.enforce_cage:
+            # Keep it bounded to box, enforce by resetting position to boundaries
+            self.x = min(max(self.x, -cw), cw)
+            self.y = min(max(self.y, -ch), ch)
+
+        return angle, mag
+
+    def snapshot(self):
+        """Position and orientation, as a JSON-able dict for restore()"""
+        return {"position": [self.x, self.y], "orientation": [self.ox, self.oy]}
+
+    def restore(self, state):
+        self.x, self.y = state["position"]
+        self.ox, self.oy = state["orientation"]
+
+    def clear(self):
+        pass
+
+    def pencolor(self, color):
+        pass
+
+    def cagecolor(self, color):
+        pass
+
+    def exit(self):
+        pass
+
+
+class BodyBatch:
+    """
+    n HeadlessBody's as arrays, for NematodeBatch: move takes and nose_touching returns one value per body.
+    """
+    def __init__(self, n, x=0.0, y=0.0, heading=0.0):
+        self.n = n
+        self.x = np.full(n, x, dtype=np.float64)
+        self.y = np.full(n, y, dtype=np.float64)
+        heading = np.radians(np.broadcast_to(np.asarray(heading, dtype=np.float64), (n,)))
+        self.ox = np.cos(heading)
+        self.oy = np.sin(heading)
+
+        self.sense_cage = True
+        self.enforce_cage = True
+
+        self.left_trim = left_trim
+        self.right_trim = right_trim
+
+    @classmethod
+    def from_snapshot(cls, n, state):
+        """n bodies all where a HeadlessBody.snapshot() or Body.snapshot() was taken."""
+        bodies = cls(n)
+        bodies.x[:], bodies.y[:] = state["position"]
+        bodies.ox[:], bodies.oy[:] = state["orientation"]
+        return bodies
+
+    def pos(self):
+        return self.x, self.y
+
+    def heading(self):
+        return np.round(np.degrees(np.arctan2(self.oy, self.ox)), 10) % 360.0
+
+    def distance(self, x, y):
+        return np.hypot(x - self.x, y - self.y)
+
+    def nose_touching(self):
+        if not self.sense_cage:
+            return np.zeros(self.n, dtype=bool)
+        return nose_touching(self.x, self.y, self.heading())
+
+    def move(self, left, right):
+        """HeadlessBody.move for every body, left and right being arrays. Returns the (angle, mag) arrays."""
+        left = np.asarray(left) + self.left_trim
+        right = np.asarray(right) + self.right_trim
+
+        angle, mag = normalize(np.abs(left - right), left + right)
+
+        turn = np.radians(np.where(left < right, angle, -angle))
+        c, s = np.cos(turn), np.sin(turn)
+        self.ox, self.oy = self.ox * c - self.oy * s, self.oy * c + self.ox * s
+
+        self.x += self.ox * mag
+        self.y += self.oy * mag
+
+        if self.enforce_cage:
+            np.clip(self.x, -cw, cw, out=self.x)
+            np.clip(self.y, -ch, ch, out=self.y)
+
+        return angle, mag
@@ -0,0 +1,65 @@
+"""
+Logging for Nematode runs, at the verbosity levels of connectome.py's -v:
+    0: only starting and exiting messages (INFO)
+    1: also whenever an obstacle or food is found (EVENT)
+    2: also the left and right motor values every step (STEP)
+
+Records go through a queue to a QueueListener thread, which buffers them and writes them out in batches,
+    to stderr or a file, so the simulation loop never waits on the terminal or the disk.
+What the loop logs at each level is only swapped in at that level (see Nematode.__init__ and main),
+    so at level 0 nothing is logged or formatted per step at all.
+"""
+import logging
+import logging.handlers
+import queue
+
+STEP = 5
+EVENT = 15
+logging.addLevelName(STEP, "STEP")
+logging.addLevelName(EVENT, "EVENT")
+
+LEVELS = {0: logging.INFO, 1: EVENT, 2: STEP}
+
+logger = logging.getLogger("nematode")
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queue records as they are, formatting them in the listener's thread instead of the loop's."""
+    def prepare(self, record):
+        return record
+
+
+def start_logging(verbosity=0, path=None, capacity=4096):
+    """
+    Send logger's records up to verbosity through a queue to path (stderr if None), written capacity records
+        at a time, or as soon as an INFO or worse one comes in.
+
+    :return: the QueueListener, to stop_logging() once done
+    """
+    if path is None:
+        out = logging.StreamHandler()
+    else:
+        out = logging.FileHandler(path)
+    out.setFormatter(logging.Formatter("%(relativeCreated)d %(levelname)s %(message)s"))
+    buffered = logging.handlers.MemoryHandler(capacity, flushLevel=logging.INFO, target=out)
+
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    logger.addHandler(handler)
+    logger.setLevel(LEVELS[min(verbosity, 2)])
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(records, buffered)
+    listener.queue_handler = handler
+    listener.start()
+    return listener
+
+
+def stop_logging(listener):
+    """Write out everything logged so far and stop listener's thread."""
+    logger.removeHandler(listener.queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        out = handler.target
+        handler.close()
+        out.close()
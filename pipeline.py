@@ -0,0 +1,68 @@
+"""
+Running the instrumentation of a run on other threads, so the loop only does the brain and body.
+
+Each step has to sense, propagate, move in that order, since each needs the last one's result. What we do with
+    a step afterwards (recording it, drawing it, logging it) doesn't, and can overlap with the next steps.
+A Pipeline is a set of Stages, each a thread taking items off its own bounded queue. The loop puts an item
+    and carries on, and the stage works through them behind it, e.g. zlib compressing and writing trace chunks
+    (which releases the GIL) while the brain runs on. Logging (log.py) and live rendering (render.py) already
+    run outside the loop this way.
+
+A full queue means the stage has fallen behind. put() then waits for room, so nothing is lost and the loop
+    runs at the stage's speed.
+
+E.g. Nematode.start_trace(..., threaded=True) gives the recorder a Pipeline, and it puts each full chunk of
+    steps on a stage to compress and write, see recorder.py.
+"""
+import queue
+import threading
+
+_STOP = object()
+
+
+class Stage(threading.Thread):
+    """Calls consume(item) on its own thread for every item put(), in order."""
+    def __init__(self, name, consume, maxsize=256):
+        super().__init__(name=name, daemon=True)
+        self.consume = consume
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+
+    def put(self, item):
+        if self.error is not None:
+            raise RuntimeError(f"pipeline stage {self.name} failed") from self.error
+        self.queue.put(item)
+
+    def run(self):
+        consume, get = self.consume, self.queue.get
+        while True:
+            item = get()
+            if item is _STOP:
+                return
+            if self.error is not None:
+                # Keep taking items so put() never blocks on a dead stage, but don't go on after a failure
+                continue
+            try:
+                consume(item)
+            except BaseException as e:
+                self.error = e
+
+    def stop(self):
+        """Finish the items queued so far and end the thread. Raises whatever consume raised, if anything."""
+        if self.is_alive():
+            self.queue.put(_STOP)
+            self.join()
+        if self.error is not None:
+            raise RuntimeError(f"pipeline stage {self.name} failed") from self.error
+
+
+class Pipeline:
+    def __init__(self):
+        self.stages = []
+
+    def add(self, name, consume, maxsize=256):
+        """Start a Stage calling consume on each item put to it. :return: the Stage"""
+        stage = Stage(name, consume, maxsize)
+        stage.start()
+        self.stages.append(stage)
+        return stage
@@ -0,0 +1,90 @@
+"""
+Watching particular neurons over particular timesteps, instead of hard-coding prints into the engines.
+
+A Probe is a neuron, a timestep range and a callback, optionally only called when a condition holds.
+Nematode.add_probe registers one, and only then does the nematode's step check for probes at all,
+    see Nematode.add_probe. For each probe in range, after the step its callback gets a ProbeHit:
+    the neuron's value going into the step, whether it fired, its value after, and (lazily) which
+    fired neurons added into it, which is what the old "timestep 997, MDL21" prints were for.
+
+e.g. nematode.add_probe("MDL21", print, start=997, stop=998)
+"""
+import numpy as np
+
+
+class ProbeHit:
+    """What a probe saw of its neuron on one step."""
+    def __init__(self, probe, timestep, compiled, fired, curr, next):
+        self.probe = probe
+        self.timestep = timestep
+        self.neuron = probe.neuron
+        self._compiled = compiled
+        self._fired = fired
+        i = probe.id
+        # Value going into the step, whether that fired it, and its value after the step
+        self.curr = int(curr[i])
+        self.fired = bool(fired[i])
+        self.next = int(next[i])
+
+    def inputs(self):
+        """[(src, w)] of every edge into the neuron from a neuron that fired this step, in edge order."""
+        c = self._compiled
+        edges = np.flatnonzero((c.dst == self.probe.id) & self._fired[c.src])
+        return [(c.index.names[c.src[e]], int(c.w[e])) for e in edges.tolist()]
+
+    @property
+    def received(self):
+        """Total weight the neuron got from neurons firing this step (not counting sensor stimulus)."""
+        return sum(w for src, w in self.inputs())
+
+    def __repr__(self):
+        return f"{self.timestep} {self.neuron}: curr {self.curr} next {self.next}" + (" fired" if self.fired else "")
+
+
+class Probe:
+    """
+    Call callback(ProbeHit) after every step with start <= timestep < stop (stop None for no end)
+        for which condition(ProbeHit) is true, or every one of them without a condition.
+    """
+    def __init__(self, neuron, callback, start=0, stop=None, condition=None, id=None):
+        self.neuron = neuron
+        self.callback = callback
+        self.start = start
+        self.stop = stop
+        self.condition = condition
+        # Neuron id, set by Probes.add
+        self.id = id
+
+    def active(self, timestep):
+        return self.start <= timestep and (self.stop is None or timestep < self.stop)
+
+
+class Probes:
+    """The probes registered on one nematode, see Nematode.add_probe."""
+    def __init__(self, compiled):
+        self.compiled = compiled
+        self.probes = []
+
+    def __len__(self):
+        return len(self.probes)
+
+    def add(self, probe):
+        probe.id = self.compiled.index.id(probe.neuron)
+        self.probes.append(probe)
+        return probe
+
+    def remove(self, probe):
+        self.probes.remove(probe)
+
+    def active(self, timestep):
+        return [probe for probe in self.probes if probe.active(timestep)]
+
+    def check(self, probes, timestep, threshold, curr, next):
+        """
+        Give each of probes a hit for the step at timestep, from curr going into it and next after it, by neuron id.
+        """
+        fired = self.compiled.can_fire & (np.abs(curr) > threshold)
+        for probe in probes:
+            hit = ProbeHit(probe, timestep, self.compiled, fired, curr, next)
+            if probe.condition is None or probe.condition(hit):
+                probe.callback(hit)
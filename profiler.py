@@ -0,0 +1,86 @@
+"""
+Which neurons and synapses the connectome spends its time on.
+
+Every time a neuron fires, each of its outgoing synapses adds its weight to its destination once,
+    and the same when a sensor neuron is stimulated. So counting firings and stimulations per neuron
+    is enough to know how many weight additions each synapse made, without touching the edges at all.
+"""
+import json
+
+import numpy as np
+
+
+class ActivityProfiler:
+    """
+    Firing and stimulation counts per neuron id of a CompiledConnectome, over however many steps of
+        however many worms were recorded, see Nematode.start_profile and NematodeBatch.start_profile.
+    """
+    def __init__(self, compiled):
+        self.compiled = compiled
+        self.names = compiled.index.names
+        self.fired = np.zeros(compiled.n, dtype=np.int64)
+        self.stimulated = np.zeros(compiled.n, dtype=np.int64)
+        # Worm-steps recorded
+        self.steps = 0
+
+    def record_fired(self, fired):
+        """Count a step's fired mask, by neuron id, or an (n_worms, n) batch of them."""
+        if fired.ndim == 1:
+            self.fired += fired
+            self.steps += 1
+        else:
+            self.fired += fired.sum(axis=0)
+            self.steps += len(fired)
+
+    def record_stimulus(self, neurons, times=1):
+        """Count the neuron ids stimulated (e.g. a sensor group), times worms over."""
+        np.add.at(self.stimulated, neurons, times)
+
+    def synapse_additions(self):
+        """Weight additions each edge of the connectome made, in its edge order."""
+        return (self.fired + self.stimulated)[self.compiled.src]
+
+    def hottest_neurons(self, k=20):
+        """[(name, firings, stimulations)] of the k neurons that fired most"""
+        order = np.argsort(-self.fired, kind="stable")[:k]
+        return [(self.names[i], int(self.fired[i]), int(self.stimulated[i])) for i in order.tolist()]
+
+    def hottest_synapses(self, k=20):
+        """[(src, dst, weight, additions)] of the k edges that added their weight most"""
+        c = self.compiled
+        additions = self.synapse_additions()
+        order = np.argsort(-additions, kind="stable")[:k]
+        return [(self.names[c.src[e]], self.names[c.dst[e]], int(c.w[e]), int(additions[e])) for e in order.tolist()]
+
+    def hot_order(self):
+        """Neuron ids from most to least active, e.g. to lay out state so the busy neurons share cache lines."""
+        return np.argsort(-(self.fired + self.stimulated), kind="stable")
+
+    def summary(self, k=10):
+        additions = self.synapse_additions()
+        total = max(int(additions.sum()), 1)
+        share = np.sort(additions)[::-1].cumsum() / total
+        lines = [f"{self.steps} steps, {int(self.fired.sum())} firings, {int(additions.sum())} weight additions",
+                 "top {} edges of {} make {:.0%} of the additions, half come from the top {}".format(
+                     k, len(additions), share[min(k, len(share)) - 1] if len(share) else 0,
+                     int(np.searchsorted(share, 0.5)) + 1),
+                 "hottest neurons:"]
+        lines += [f"    {name:<8} {fired:>10} fired {stimulated:>10} stimulated"
+                  for name, fired, stimulated in self.hottest_neurons(k)]
+        lines.append("hottest synapses:")
+        lines += [f"    {src:<8} -> {dst:<8} {w:>4} {n:>10}" for src, dst, w, n in self.hottest_synapses(k)]
+        return "\n".join(lines)
+
+    def export(self, path, k=None):
+        """
+        Write the k hottest (all by default) neurons and synapses, hottest first, to path as JSON.
+        """
+        data = {
+            "steps": self.steps,
+            "neurons": [{"name": name, "fired": fired, "stimulated": stimulated}
+                        for name, fired, stimulated in self.hottest_neurons(k or self.compiled.n)],
+            "synapses": [{"src": src, "dst": dst, "weight": w, "additions": n}
+                         for src, dst, w, n in self.hottest_synapses(k or len(self.compiled.src))],
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1)
@@ -0,0 +1,624 @@
+"""
+Chunked, compressed recordings of a run.
+
+There are two formats. A trace (TraceWriter, TraceReader) is dense, one row per timestep.
+A spike log (SpikeWriter, SpikeReader) keeps only what can't be recomputed, see SpikeWriter.
+
+A trace holds, per timestep:
+    timestep    int64
+    state       int64 per neuron, curr after the step, by neuron id
+    fired       the neurons that fired on the step, a bit per neuron
+    accumleft, accumright   int64 motor values sent to the body
+    x, y, heading           float64 body pose after moving, nan without a body
+    stimulus    uint8 bits of the sensors triggered before the step, see STIMULUS
+
+Rows are buffered into fixed size chunks, and each chunk is written column by column, each column
+    byte-shuffled (all first bytes, then all second bytes, ...) and zlib compressed on its own.
+Neuron values are small and mostly repeat step to step, so shuffled they compress very well, and
+    a reader after only some columns decompresses only those.
+
+Layout:
+    8 bytes     magic
+    8 bytes     little-endian length of the JSON header
+    header      {"names": [...], "columns": {name: {"dtype", "shape"}}, "chunk_steps", "meta"}
+    chunks, each:
+        8 bytes     little-endian length of the chunk's JSON header
+        header      {"t0": first timestep, "rows": n, "sizes": {name: compressed bytes}}
+        each column's compressed bytes, in header order
+    index       JSON [[t0, rows, offset of the chunk], ...]
+    8 bytes     little-endian length of the index
+    8 bytes     index magic
+Spike logs are laid out the same, with their own magic and chunk header fields.
+
+The index is written on close, so a reader can go straight to the chunk holding any timestep.
+    A file whose writer never closed it (a crash) has none, and is read by scanning its chunks instead.
+
+Given a pipeline.Pipeline, a writer compresses and writes its chunks on a stage of it instead, while record()
+    fills a second set of chunk buffers, so the recording thread only copies each step into its buffers.
+"""
+import bisect
+import json
+import queue
+import zlib
+
+import numpy as np
+
+from engine import MotorReadout
+
+MAGIC = b"A1TRACE1"
+SPIKE_MAGIC = b"A1SPIKE1"
+INDEX_MAGIC = b"A1INDEX1"
+
+# Bits of the stimulus column
+STIMULUS = {"food_sensors": 1, "nose_touch_sensors": 2, "anterior_harsh_touch_sensors": 4}
+
+
+def _shuffle(a):
+    """The bytes of a, grouped by byte position within each element."""
+    return np.ascontiguousarray(a).view(np.uint8).reshape(-1, a.dtype.itemsize).T.tobytes()
+
+
+def _unshuffle(data, dtype, shape):
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1).T.copy()
+    return raw.view(dtype).reshape(shape)
+
+
+def _write_header(f, magic, header):
+    header = json.dumps(header).encode()
+    f.write(magic)
+    f.write(len(header).to_bytes(8, "little"))
+    f.write(header)
+
+
+def _read_header(f, magic):
+    if f.read(len(magic)) != magic:
+        raise ValueError(f"{f.name} is not a {magic.decode()} file")
+    return json.loads(f.read(int.from_bytes(f.read(8), "little")))
+
+
+def _write_chunk(f, header, arrays, level):
+    """
+    Write {name: array} compressed, after a chunk header with their compressed sizes added.
+    Returns where the chunk starts.
+    """
+    offset = f.tell()
+    blobs = {name: zlib.compress(_shuffle(a), level) for name, a in arrays.items()}
+    header = dict(header, sizes={name: len(blob) for name, blob in blobs.items()})
+    header = json.dumps(header).encode()
+    f.write(len(header).to_bytes(8, "little"))
+    f.write(header)
+    for blob in blobs.values():
+        f.write(blob)
+    return offset
+
+
+def _read_chunk_header(f):
+    """The next chunk's header, leaving f at its first column, or None at the end of the file."""
+    length = f.read(8)
+    if len(length) < 8:
+        return None
+    return json.loads(f.read(int.from_bytes(length, "little")))
+
+
+def _read_index(f, start):
+    """
+    [(t0, rows, offset)] of every chunk of f, whose chunks begin at start.
+    From the index if there is one, else by reading the chunk headers, up to any chunk cut short.
+    """
+    end = f.seek(0, 2)
+    if end - start >= 16:
+        f.seek(end - 16)
+        length = int.from_bytes(f.read(8), "little")
+        if f.read(8) == INDEX_MAGIC:
+            f.seek(end - 16 - length)
+            return [tuple(entry) for entry in json.loads(f.read(length))]
+
+    index = []
+    f.seek(start)
+    while True:
+        offset = f.tell()
+        try:
+            chunk = _read_chunk_header(f)
+        except ValueError:
+            break
+        if chunk is None:
+            break
+        size = sum(chunk["sizes"].values())
+        if f.tell() + size > end:
+            break
+        index.append((chunk["t0"], chunk["rows"], offset))
+        f.seek(size, 1)
+    return index
+
+
+class _Writer:
+    """
+    What TraceWriter and SpikeWriter share: writing chunks, on a pipeline stage if given one, and the index on close.
+    Each keeps its chunk's rows in self.buffers, a {name: array} dict made by _buffers().
+    """
+    def _open(self, path, magic, header, pipeline=None):
+        self.file = open(path, "wb")
+        _write_header(self.file, magic, header)
+        self.index = []
+        self.buffers = self._buffers()
+        self.stage = None
+        if pipeline is not None:
+            # Buffers to go on filling while the stage writes the last ones out, and which it hands back after
+            self.spare = queue.Queue()
+            self.spare.put(self._buffers())
+            self.stage = pipeline.add("recorder", self._write_chunk, maxsize=2)
+
+    def _write(self, t0, rows, header, arrays):
+        """Write a chunk of arrays, views of self.buffers or new, which we mustn't change after."""
+        if self.stage is None:
+            self._write_chunk((t0, rows, header, arrays, None))
+            return
+        self.stage.put((t0, rows, header, arrays, self.buffers))
+        self.buffers = self.spare.get()
+
+    def _write_chunk(self, chunk):
+        t0, rows, header, arrays, buffers = chunk
+        try:
+            offset = _write_chunk(self.file, dict(header, t0=t0, rows=rows), arrays, self.level)
+            self.index.append((t0, rows, offset))
+        finally:
+            # Even if that failed, so _write isn't left waiting for them, and raises the stage's error instead
+            if buffers is not None:
+                self.spare.put(buffers)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        if self.stage is not None:
+            self.stage.stop()
+        index = json.dumps(self.index).encode()
+        self.file.write(index)
+        self.file.write(len(index).to_bytes(8, "little"))
+        self.file.write(INDEX_MAGIC)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Reader:
+    """What TraceReader and SpikeReader share: the header, the chunk index, and reading a chunk's columns."""
+    def _open(self, path, magic):
+        self.path = path
+        with open(path, "rb") as f:
+            header = _read_header(f, magic)
+            self.index = _read_index(f, f.tell())
+        self.starts = [t0 for t0, _, _ in self.index]
+        return header
+
+    def __len__(self):
+        return sum(rows for _, rows, _ in self.index)
+
+    def chunk_of(self, timestep):
+        """Which chunk holds timestep"""
+        i = bisect.bisect_right(self.starts, timestep) - 1
+        if i < 0 or timestep >= self.index[i][0] + self.index[i][1]:
+            raise IndexError(f"timestep {timestep} is not in {self.path}")
+        return i
+
+    def _read(self, f, i, columns=None):
+        """(chunk header, {name: decompressed bytes}) of chunk i, for the given columns or all of them."""
+        f.seek(self.index[i][2])
+        chunk = _read_chunk_header(f)
+        out = {}
+        for name, size in chunk["sizes"].items():
+            if columns is not None and name not in columns:
+                f.seek(size, 1)
+                continue
+            out[name] = zlib.decompress(f.read(size))
+        return chunk, out
+
+
+class TraceWriter(_Writer):
+    """
+    Writes a trace to path, a chunk every chunk_steps rows.
+
+    Call record() once per timestep, and close() (or use it as a context manager) at the end
+        to write out the last partial chunk.
+    """
+    def __init__(self, path, names, chunk_steps=4096, level=6, meta=None, pipeline=None):
+        self.path = path
+        self.names = list(names)
+        self.chunk_steps = chunk_steps
+        self.level = level
+        n = len(self.names)
+
+        # (dtype, shape of one row), fired stored packed
+        self.columns = {
+            "timestep": (np.int64, ()),
+            "state": (np.int64, (n,)),
+            "fired": (np.uint8, ((n + 7) // 8,)),
+            "accumleft": (np.int64, ()),
+            "accumright": (np.int64, ()),
+            "x": (np.float64, ()),
+            "y": (np.float64, ()),
+            "heading": (np.float64, ()),
+            "stimulus": (np.uint8, ()),
+        }
+        self.rows = 0
+
+        self._open(path, MAGIC, {
+            "names": self.names,
+            "columns": {name: {"dtype": np.dtype(dtype).str, "shape": list(shape)}
+                        for name, (dtype, shape) in self.columns.items()},
+            "chunk_steps": chunk_steps,
+            "meta": meta,
+        }, pipeline)
+
+    def _buffers(self):
+        return {name: np.zeros((self.chunk_steps,) + shape, dtype=dtype) for name, (dtype, shape) in self.columns.items()}
+
+    def state_buffer(self):
+        """Where the next record()'s state goes, to write it into directly and then record() with state None."""
+        return self.buffers["state"][self.rows]
+
+    def record(self, timestep, state, fired, accumleft, accumright, pose=None, stimulus=0):
+        """
+        Buffer one timestep.
+
+        :param state: curr, by neuron id, or None if it's been written into state_buffer()
+        :param fired: boolean mask of the neurons fired, by neuron id
+        :param pose: (x, y, heading) of the body, or None
+        :param stimulus: STIMULUS bits
+        """
+        i = self.rows
+        b = self.buffers
+        b["timestep"][i] = timestep
+        if state is not None:
+            b["state"][i] = state
+        b["fired"][i] = np.packbits(fired)
+        b["accumleft"][i] = accumleft
+        b["accumright"][i] = accumright
+        if pose is None:
+            b["x"][i] = b["y"][i] = b["heading"][i] = np.nan
+        else:
+            b["x"][i], b["y"][i], b["heading"][i] = pose
+        b["stimulus"][i] = stimulus
+
+        self.rows += 1
+        if self.rows == self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        """Write out the buffered rows as a chunk."""
+        if not self.rows:
+            return
+        self._write(int(self.buffers["timestep"][0]), self.rows, {},
+                    {name: buffer[:self.rows] for name, buffer in self.buffers.items()})
+        self.rows = 0
+
+
+class TraceReader(_Reader):
+    """
+    Reads a trace written by TraceWriter.
+
+    chunks() yields one {column: array} dict per chunk, read() concatenates them.
+        Both take the columns wanted, all of them by default, and the timesteps wanted as [start, stop),
+        all of them by default. fired comes back as a boolean mask.
+    """
+    def __init__(self, path):
+        header = self._open(path, MAGIC)
+        self.names = header["names"]
+        self.columns = header["columns"]
+        self.chunk_steps = header["chunk_steps"]
+        self.meta = header["meta"]
+
+    def chunks(self, columns=None, start=None, stop=None):
+        columns = list(self.columns) if columns is None else list(columns)
+        n = len(self.names)
+        first = 0 if start is None else max(bisect.bisect_right(self.starts, start) - 1, 0)
+        with open(self.path, "rb") as f:
+            for i in range(first, len(self.index)):
+                t0, rows, _ = self.index[i]
+                if stop is not None and t0 >= stop:
+                    return
+                # Rows of this chunk within [start, stop)
+                a = 0 if start is None else min(max(start - t0, 0), rows)
+                b = rows if stop is None else min(max(stop - t0, 0), rows)
+                _, data = self._read(f, i, columns)
+                out = {}
+                for name, raw in data.items():
+                    spec = self.columns[name]
+                    values = _unshuffle(raw, spec["dtype"], [rows] + spec["shape"])[a:b]
+                    if name == "fired":
+                        values = np.unpackbits(values, axis=1, count=n).astype(bool)
+                    out[name] = values
+                yield out
+
+    def read(self, columns=None, start=None, stop=None):
+        columns = list(self.columns) if columns is None else list(columns)
+        parts = {name: [] for name in columns}
+        for chunk in self.chunks(columns, start, stop):
+            for name, a in chunk.items():
+                parts[name].append(a)
+        return {name: np.concatenate(a) if a else np.zeros(0) for name, a in parts.items()}
+
+
+class SpikeWriter(_Writer):
+    """
+    Writes a spike log to path.
+
+    Most neurons are below threshold on any given step, and given the state before a step, which neurons fired
+        and which sensors were triggered, the state after it follows from the connectome alone.
+    So per timestep we keep just the ids of the neurons fired, the sensors triggered (STIMULUS bits)
+        and the motor values sent, and every keyframe_every steps a dense keyframe of curr and next
+        from before that step, along with the body's snapshot() and the rest of the nematode's state
+        (threshold, accumulators). SpikeReader and Replay replay from the nearest keyframe.
+
+    Each chunk is one keyframe and the steps following it: t0 (the first step), rows, pose, state and the columns
+        keyframe_curr, keyframe_next, stimulus, accumleft, accumright, fire_counts (per step), fire_ids.
+
+    Call keyframe() before the first record(), and again whenever keyframe_due is set after a record()
+        (every keyframe_every records), in between steps, before the next step's sensors are triggered.
+    """
+    def __init__(self, path, names, keyframe_every=1000, level=6, meta=None, pipeline=None):
+        self.path = path
+        self.names = list(names)
+        self.keyframe_every = keyframe_every
+        self.level = level
+        # Neuron ids as the smallest integer type that holds them
+        self.id_dtype = np.int16 if len(self.names) < 2**15 else np.int32
+
+        self.fire_ids = []
+        self.rows = 0
+        self.t0 = None
+        self.frame = None
+        self.keyframe_due = True
+
+        self._open(path, SPIKE_MAGIC, {"names": self.names, "keyframe_every": keyframe_every, "meta": meta}, pipeline)
+
+    def _buffers(self):
+        return {name: np.zeros(self.keyframe_every, dtype=dtype) for name, dtype in
+                (("stimulus", np.uint8), ("accumleft", np.int64), ("accumright", np.int64), ("fire_counts", np.int32))}
+
+    def keyframe(self, curr, next, pose=None, state=None):
+        """
+        Start a new chunk from curr and next (as vectors by neuron id), writing out the last.
+
+        :param pose: the body's snapshot(), if there is a body
+        :param state: anything else JSON-able needed to carry on from here, e.g. the threshold
+        """
+        self.flush()
+        self.frame = (np.array(curr, dtype=np.int64), np.array(next, dtype=np.int64), pose, state)
+        self.keyframe_due = False
+
+    def record(self, timestep, fired, accumleft, accumright, stimulus=0):
+        """
+        Log one timestep.
+
+        :param fired: boolean mask by neuron id of the neurons fired
+        :param stimulus: STIMULUS bits of the sensors triggered before the step
+        """
+        i = self.rows
+        if i == 0:
+            self.t0 = timestep
+        ids = np.flatnonzero(fired).astype(self.id_dtype)
+        self.fire_ids.append(ids)
+        b = self.buffers
+        b["fire_counts"][i] = len(ids)
+        b["stimulus"][i] = stimulus
+        b["accumleft"][i] = accumleft
+        b["accumright"][i] = accumright
+
+        self.rows += 1
+        if self.rows == self.keyframe_every:
+            self.keyframe_due = True
+
+    def flush(self):
+        if not self.rows:
+            return
+        rows = self.rows
+        curr, next, pose, state = self.frame
+        self._write(self.t0, rows, {"pose": pose, "state": state}, {
+            "keyframe_curr": curr,
+            "keyframe_next": next,
+            "stimulus": self.buffers["stimulus"][:rows],
+            "accumleft": self.buffers["accumleft"][:rows],
+            "accumright": self.buffers["accumright"][:rows],
+            "fire_counts": self.buffers["fire_counts"][:rows],
+            "fire_ids": np.concatenate(self.fire_ids),
+        })
+        self.fire_ids = []
+        self.rows = 0
+        self.frame = None
+        self.keyframe_due = True
+
+
+class SpikeReader(_Reader):
+    """
+    Reads a spike log written by SpikeWriter, rebuilding state with compiled, a CompiledConnectome
+        with the same neurons and weights the log was recorded with.
+
+    state_at(t) is curr after step t, the same as the state column of a trace at t.
+        It's replayed from the keyframe before t, so costs at most keyframe_every steps. See also Replay.
+    """
+    def __init__(self, path, compiled):
+        header = self._open(path, SPIKE_MAGIC)
+        self.compiled = compiled
+        self.names = header["names"]
+        self.keyframe_every = header["keyframe_every"]
+        self.meta = header["meta"] or {}
+        if list(compiled.index.names) != self.names:
+            raise ValueError(f"{path} was recorded with different neurons")
+
+        index = compiled.index
+        self.readout = MotorReadout(index)
+        # The fused engine doesn't keep the muscles outside both motor groups, so they stay 0 in its logs
+        self.dropped = index.muscle & ~self.readout.muscles if self.meta.get("engine") == "fused" else None
+        self.stimuli = {bit: compiled.stimulus(getattr(index, group)) for group, bit in STIMULUS.items()}
+
+        id_dtype = np.int16 if len(self.names) < 2**15 else np.int32
+        self.dtypes = {"keyframe_curr": np.int64, "keyframe_next": np.int64, "stimulus": np.uint8,
+                       "accumleft": np.int64, "accumright": np.int64, "fire_counts": np.int32, "fire_ids": id_dtype}
+
+    def read_chunk(self, i):
+        """
+        Columns of chunk i, with fire_ids split into one array of ids per step as "fired",
+            and its keyframe's body "pose" and nematode "state".
+        """
+        t0, rows, _ = self.index[i]
+        with open(self.path, "rb") as f:
+            chunk, data = self._read(f, i)
+        out = {}
+        for name, raw in data.items():
+            dtype = np.dtype(self.dtypes[name])
+            out[name] = _unshuffle(raw, dtype, (len(raw) // dtype.itemsize,))
+        out["fired"] = np.split(out["fire_ids"].astype(np.int64), np.cumsum(out["fire_counts"])[:-1])
+        out["timestep"] = np.arange(t0, t0 + rows)
+        out["pose"] = chunk["pose"]
+        out["state"] = chunk.get("state")
+        return out
+
+    def events(self):
+        """(timestep, neuron id) of every firing, as two arrays."""
+        timesteps, ids = [], []
+        for i in range(len(self.index)):
+            chunk = self.read_chunk(i)
+            timesteps.append(np.repeat(chunk["timestep"], chunk["fire_counts"]))
+            ids.append(chunk["fire_ids"].astype(np.int64))
+        return np.concatenate(timesteps), np.concatenate(ids)
+
+    def motors(self):
+        """(timestep, accumleft, accumright) arrays of every step."""
+        chunks = [self.read_chunk(i) for i in range(len(self.index))]
+        return tuple(np.concatenate([c[name] for c in chunks]) for name in ("timestep", "accumleft", "accumright"))
+
+    def step(self, curr, next, fired, stimulus):
+        """
+        One step of the brain on (curr, next), given the ids that fired and the STIMULUS bits.
+        Returns the (left, right) motor values it sends, which should match the ones logged.
+        """
+        for bit, vector in self.stimuli.items():
+            if stimulus & bit:
+                next += vector
+        mask = np.zeros(self.compiled.n, dtype=bool)
+        mask[fired] = True
+        y = self.compiled.inputs.matvec(mask)
+        np.add(next, y[:self.compiled.n], out=next)
+        np.copyto(next, y[self.compiled.n:], where=mask)
+        left, right = self.readout.read(next)
+        if self.dropped is not None:
+            np.copyto(next, 0, where=self.dropped)
+        np.copyto(curr, next)
+        return int(left), int(right)
+
+    def state_at(self, timestep):
+        """curr after step timestep, replayed from the keyframe before it."""
+        chunk = self.read_chunk(self.chunk_of(timestep))
+        curr, next = chunk["keyframe_curr"].copy(), chunk["keyframe_next"].copy()
+        for i in range(timestep - chunk["timestep"][0] + 1):
+            self.step(curr, next, chunk["fired"][i], chunk["stimulus"][i])
+        return curr
+
+
+class Replay:
+    """
+    Seekable playback of a spike log: the brain's curr and next (by neuron id), what fired and the motor values
+        sent on each step, and, if the run had a body, a kinematics.HeadlessBody following the same path.
+
+    seek(t) puts it right after step t, starting from the keyframe before t, so it costs at most keyframe_every
+        steps however deep into the run t is. step() then moves on a step at a time, and stream(start, stop)
+        does both, yielding itself after each step.
+
+    The body is replayed from the motor values, with the default trims and cage. It's exact for runs of a
+        body.Body or kinematics.HeadlessBody with those, which is every run connectome.py makes.
+    """
+    def __init__(self, path, compiled=None):
+        if compiled is None:
+            from engine import CompiledConnectome
+            compiled = CompiledConnectome.load()
+        self.log = SpikeReader(path, compiled)
+        self.compiled = compiled
+
+        self.timestep = None
+        self.curr = None
+        self.next = None
+        self.fired = None
+        self.accumleft = 0
+        self.accumright = 0
+        self.threshold = None
+        self.body = None
+
+        self.chunk = None
+        self.chunk_i = None
+
+    def __len__(self):
+        return len(self.log)
+
+    def load(self, i):
+        """Go to the keyframe of chunk i, right before its first step."""
+        from kinematics import HeadlessBody
+        chunk = self.log.read_chunk(i)
+        self.chunk = chunk
+        self.chunk_i = i
+        self.timestep = int(chunk["timestep"][0]) - 1
+        self.curr = chunk["keyframe_curr"].copy()
+        self.next = chunk["keyframe_next"].copy()
+        self.fired = None
+        state = chunk["state"] or {}
+        self.threshold = state.get("threshold")
+        self.accumleft = state.get("accumleft", 0)
+        self.accumright = state.get("accumright", 0)
+        if chunk["pose"] is None:
+            self.body = None
+        else:
+            self.body = HeadlessBody()
+            self.body.restore(chunk["pose"])
+
+    def seek(self, timestep):
+        """Go to right after step timestep."""
+        i = self.log.chunk_of(timestep)
+        if i != self.chunk_i or self.timestep > timestep:
+            self.load(i)
+        while self.timestep < timestep:
+            self.step()
+        return self
+
+    def step(self):
+        """Replay the next step. Raises IndexError past the end of the log."""
+        t = self.timestep + 1
+        if self.chunk is None or t > self.chunk["timestep"][-1]:
+            # Carry on into the next chunk from its keyframe, which is where we are anyway
+            self.load(self.log.chunk_of(t))
+        i = t - int(self.chunk["timestep"][0])
+        self.fired = self.chunk["fired"][i]
+        self.accumleft, self.accumright = self.log.step(self.curr, self.next, self.fired, self.chunk["stimulus"][i])
+        if self.body is not None:
+            self.body.move(self.accumleft, self.accumright)
+        self.timestep = t
+        return self
+
+    def stream(self, start, stop=None):
+        """Yield this after each step from start up to (not including) stop, or to the end of the log."""
+        if stop is None:
+            t0, rows, _ = self.log.index[-1]
+            stop = t0 + rows
+        if start >= stop:
+            return
+        yield self.seek(start)
+        while self.timestep < stop - 1:
+            yield self.step()
+
+    def nematode(self, engine="dict"):
+        """
+        A connectome.Nematode, with a HeadlessBody, in the state replayed to, to carry on from or poke at.
+        """
+        import connectome
+        nematode = connectome.Nematode(engine=engine, body=self.body.__class__() if self.body is not None else None)
+        nematode.set_state_vectors(self.curr, self.next)
+        nematode.timestep = self.timestep + 1
+        if self.threshold is not None:
+            nematode.threshold = self.threshold
+        if self.body is not None:
+            nematode.body.restore(self.body.snapshot())
+        return nematode
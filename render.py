@@ -0,0 +1,219 @@
+"""
+Drawing the body from another process, so the simulation never waits on Tk.
+
+The simulation moves a RenderedBody, which is a kinematics.HeadlessBody (so the same trajectory as body.Body)
+    that also writes every pose, with the pen and cage colours main() set, into a PoseRing in shared memory.
+A Renderer in its own process reads the ring at a fixed frame rate and draws whatever poses came in since
+    its last frame onto a turtle window, as a trail.Trail.
+
+The simulation never blocks on the renderer: the ring just overwrites its oldest poses, and if the renderer
+    falls behind by more than the ring holds, the poses it missed are dropped (the trail jumps), as are frames
+    it had no time for. Either way the simulation runs at its own speed and the window shows where it is now.
+"""
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from kinematics import HeadlessBody, cw, ch
+from trail import Trail
+
+# Pen and cage colours, as stored in the ring. The ones Nematode.main uses: blue normally, red on food, black on a wall.
+COLORS = ("blue", "red", "black")
+
+# Fields of each pose in the ring: move count, position, orientation vector (see HeadlessBody),
+#   pen and cage colour (index into COLORS) and how many times the drawing has been cleared.
+FIELDS = ("move", "x", "y", "ox", "oy", "pen", "cage", "clears")
+
+
+class PoseRing:
+    """
+    The last capacity poses written, in shared memory, for one writer and any number of readers.
+
+    The header holds how many poses have been written in all, and whether the writer is done.
+    Pose i is at row i % capacity. Readers check the count again after copying rows out, and drop any the
+        writer may have overwritten meanwhile, so they never see a half written pose.
+    """
+    def __init__(self, capacity=4096, name=None):
+        header = 2 * 8
+        size = header + capacity * len(FIELDS) * 8
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.shm.name
+        self.capacity = capacity
+        # written, closed
+        self.header = np.ndarray(2, dtype=np.int64, buffer=self.shm.buf)
+        self.rows = np.ndarray((capacity, len(FIELDS)), dtype=np.float64, buffer=self.shm.buf, offset=header)
+        if self.owner:
+            self.header[:] = 0
+
+    @property
+    def written(self):
+        return int(self.header[0])
+
+    @property
+    def closed(self):
+        return bool(self.header[1])
+
+    def write(self, pose):
+        """Write one pose, a tuple of FIELDS."""
+        written = self.header[0]
+        self.rows[written % self.capacity] = pose
+        self.header[0] = written + 1
+
+    def read(self, since):
+        """
+        :return: (poses, written, dropped): an array of the poses written since pose number since, up to written,
+            and how many of those were overwritten before we got to them and so are missing from poses.
+        """
+        written = self.written
+        start = max(since, written - self.capacity)
+        rows = self.rows[np.arange(start, written) % self.capacity]
+        # Anything the writer got to while we were copying may be torn, including the row it may be writing
+        #   right now, pose written's, which held pose written - capacity
+        overwritten = self.written - self.capacity + 1
+        if overwritten > start:
+            rows = rows[overwritten - start:]
+            start = overwritten
+        return rows, written, start - since
+
+    def close(self):
+        """Mark the ring done (when the writer closes it), and let go of the shared memory."""
+        if self.owner:
+            self.header[1] = 1
+        del self.header, self.rows
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RenderedBody(HeadlessBody):
+    """
+    A HeadlessBody that writes its pose into a PoseRing after every move, for a Renderer to draw.
+    The drawing calls main() makes just set what goes into the next pose.
+    """
+    def __init__(self, ring, x=0.0, y=0.0, heading=0.0):
+        super().__init__(x, y, heading)
+        self.ring = ring
+        self.moves = 0
+        self.pen = 0
+        self.cage = 0
+        self.clears = 0
+        self._colors = {color: i for i, color in enumerate(COLORS)}
+        self._write()
+
+    def _write(self):
+        self.ring.write((self.moves, self.x, self.y, self.ox, self.oy, self.pen, self.cage, self.clears))
+
+    def move(self, left, right):
+        moved = super().move(left, right)
+        self.moves += 1
+        self._write()
+        return moved
+
+    def restore(self, state):
+        super().restore(state)
+        # A pose without a move in between, which the Renderer jumps to without drawing a line
+        self._write()
+
+    def clear(self):
+        self.clears += 1
+
+    def pencolor(self, color):
+        self.pen = self._colors[color]
+
+    def cagecolor(self, color):
+        self.cage = self._colors[color]
+
+
+class Renderer:
+    """
+    Draws a PoseRing's poses in a turtle window, fps times a second, until the ring is closed.
+    Run it in its own process with start_renderer().
+    """
+    def __init__(self, ring_name, capacity, fps=30):
+        self.ring_name = ring_name
+        self.capacity = capacity
+        self.period = 1 / fps
+        self.seen = 0
+        self.clears = 0
+        # Move count of the last pose drawn
+        self.move = None
+        self.frames = 0
+        self.frames_dropped = 0
+        self.poses_dropped = 0
+
+    def run(self):
+        import turtle
+        from body import setup_screen
+
+        self.ring = PoseRing(self.capacity, self.ring_name)
+        setup_screen()
+        turtle.tracer(0, 0)
+        self.screen = turtle.Screen()
+        self.canvas = turtle.getcanvas()
+        self.cage = self.canvas.create_rectangle(-cw, ch, cw, -ch, width=3, outline="red")
+        self.trail = Trail(self.canvas)
+        self.head = turtle.Turtle()
+        self.head.penup()
+        self.due = time.perf_counter()
+        self.frame()
+        turtle.mainloop()
+
+    def draw(self, poses):
+        trail = self.trail
+        for move, x, y, ox, oy, pen, cage, clears in poses.tolist():
+            # Start over on every clear, like turtle's clear() does
+            if clears != self.clears:
+                self.clears = clears
+                trail.clear()
+            # A restore(), which jumps there without a move
+            if move == self.move:
+                trail.lift()
+            trail.add(x, y, COLORS[int(pen)])
+            self.move = move
+        trail.draw()
+
+        self.canvas.itemconfig(self.cage, outline=COLORS[int(cage)])
+        self.head.setpos(x, y)
+        self.head.setheading(np.degrees(np.arctan2(oy, ox)))
+        self.head.pencolor(COLORS[int(pen)])
+
+    def frame(self):
+        import turtle
+        closed = self.ring.closed
+        poses, self.seen, dropped = self.ring.read(self.seen)
+        self.poses_dropped += dropped
+        if len(poses):
+            self.draw(poses)
+        turtle.update()
+        self.frames += 1
+
+        if closed:
+            self.ring.close()
+            self.screen.ontimer(self.screen.bye, 3000)
+            return
+
+        # Next frame on the frame grid, skipping the frames we're already too late for
+        now = time.perf_counter()
+        self.due += self.period
+        if now > self.due:
+            skipped = int((now - self.due) / self.period) + 1
+            self.frames_dropped += skipped
+            self.due += skipped * self.period
+        self.screen.ontimer(self.frame, max(int((self.due - now) * 1000), 1))
+
+
+def _render(ring_name, capacity, fps):
+    Renderer(ring_name, capacity, fps).run()
+
+
+def start_renderer(ring, fps=30):
+    """
+    Start a Renderer of ring in a new process, which exits a few seconds after the ring is closed.
+    :return: the multiprocessing.Process, to join once the ring is closed
+    """
+    process = multiprocessing.get_context("spawn").Process(target=_render, args=(ring.name, ring.capacity, fps))
+    process.start()
+    return process
@@ -0,0 +1,100 @@
+"""
+Pacing Nematode.main in real time, for the robot and live demos.
+
+RealtimeScheduler runs the loop at a fixed rate of ticks a second, where each tick is substeps timesteps
+    of which only the first senses, and the body moves once at the end of it by the sum of them all.
+    Tick i is due at start + i * period, on a fixed grid rather than a period after the last one finished,
+    so time spent working doesn't add up into drift. A tick that finishes early sleeps until the next one is due.
+    One that finishes late (an overrun) doesn't sleep, so the ticks after it catch up, unless it's more than
+    max_lag behind, in which case we give up on those ticks and start the grid over from now, rather than
+    running flat out for ages to catch up.
+
+The rate is given as e.g. "10hz", as a real-time factor like "1x" (where one timestep is STEP_SECONDS of worm time,
+    so "1x" is what the old time_delays' sleep(0.1) after each step was aiming for), or "max" for as fast as possible.
+"""
+import time
+
+# Worm time per timestep, as the old time_delays paced it
+STEP_SECONDS = 0.1
+
+
+class RealtimeScheduler:
+    def __init__(self, rate=None, substeps=1, max_lag=1.0, clock=time.perf_counter, sleep=time.sleep):
+        """
+        :param rate: ticks a second, None for as fast as possible
+        :param substeps: timesteps per tick, where the sensors only run on the first and the body moves after the last
+        :param max_lag: seconds behind schedule after which we skip the missed ticks instead of catching up
+        """
+        self.rate = rate
+        self.period = 1 / rate if rate else 0
+        self.substeps = substeps
+        self.max_lag = max_lag
+        self.clock = clock
+        self.sleep = sleep
+
+        self.started = None
+        self.due = None
+        self.ticks = 0
+        self.overruns = 0
+        # Total and worst seconds past due over all overruns
+        self.late = 0
+        self.worst = 0
+        # Times we gave up catching up, and the ticks that skipped
+        self.resyncs = 0
+        self.skipped = 0
+        self.slept = 0
+
+    @classmethod
+    def parse(cls, spec, substeps=1, **kwargs):
+        """A scheduler for a rate like "10hz", "2x" (real time factor, see STEP_SECONDS) or "max"."""
+        spec = spec.lower()
+        if spec == "max":
+            rate = None
+        elif spec.endswith("hz"):
+            rate = float(spec[:-2])
+        elif spec.endswith("x"):
+            # A tick is substeps timesteps of worm time
+            rate = float(spec[:-1]) / (STEP_SECONDS * substeps)
+        else:
+            raise ValueError(f"Unknown rate {spec!r}, expected e.g. 10hz, 1x or max")
+        return cls(rate, substeps, **kwargs)
+
+    def start(self):
+        self.started = self.clock()
+        self.due = self.started + self.period
+
+    def tick(self):
+        """Call at the end of every tick. Sleeps until the next is due, and keeps count of the ones that run late."""
+        if self.started is None:
+            self.start()
+        self.ticks += 1
+        if not self.period:
+            return
+
+        now = self.clock()
+        slack = self.due - now
+        if slack > 0:
+            self.sleep(slack)
+            self.slept += slack
+            self.due += self.period
+            return
+
+        self.overruns += 1
+        self.late += -slack
+        self.worst = max(self.worst, -slack)
+        if -slack > self.max_lag:
+            # Too far behind to catch up, skip the ticks we missed and carry on from now
+            missed = int(-slack / self.period)
+            self.skipped += missed
+            self.resyncs += 1
+            self.due += missed * self.period
+        self.due += self.period
+
+    def report(self):
+        elapsed = self.clock() - self.started if self.started is not None else 0
+        rate = self.ticks / elapsed if elapsed else 0
+        target = f"{self.rate:g}/s" if self.rate else "as fast as possible"
+        return (f"{self.ticks} ticks of {self.substeps} steps in {elapsed:.1f}s, {rate:.1f}/s for {target}, "
+                f"{rate * self.substeps * STEP_SECONDS:.2f}x real time, slept {self.slept:.1f}s. "
+                f"{self.overruns} overruns, {self.late:.2f}s late in all, worst {self.worst * 1e3:.1f}ms, "
+                f"{self.resyncs} resyncs skipping {self.skipped} ticks")
@@ -0,0 +1,45 @@
+"""
+The array engines against the dict engine, which is the reference: run side by side on headless bodies,
+    every engine has to give the same state and the same trajectory, step for step.
+
+    python -m pytest test_engines.py
+"""
+import numpy as np
+import pytest
+
+from connectome import Nematode
+from kinematics import HeadlessBody
+
+STEPS = 3000
+
+
+def step(nematode):
+    """One step of Nematode.main, without the drawing"""
+    body = nematode.body
+    if body.nose_touching():
+        nematode.trigger_nose_touch_sensors()
+    elif nematode.environment.food_sensed(body, nematode.timestep):
+        nematode.trigger_food_sensors()
+    nematode.propagate_connectome()
+    nematode.timestep += 1
+
+
+@pytest.mark.parametrize("engine", ["csr", "active", "fused"])
+def test_matches_dict_engine(engine):
+    reference = Nematode(engine="dict", body=HeadlessBody())
+    nematode = Nematode(engine=engine, body=HeadlessBody())
+    # The fused engine sums the muscles into LEFT and RIGHT, so only the neurons and the motor totals compare
+    compared = ~reference.compiled.index.muscle if engine == "fused" else slice(None)
+
+    touched = 0
+    for t in range(STEPS):
+        step(reference)
+        step(nematode)
+        for expected, actual in zip(reference.state_vectors(), nematode.state_vectors()):
+            np.testing.assert_array_equal(actual[compared], expected[compared], err_msg=f"timestep {t}")
+        assert (nematode.accumleft, nematode.accumright) == (reference.accumleft, reference.accumright), t
+        assert nematode.body.snapshot() == reference.body.snapshot(), t
+        touched += reference.body.nose_touching()
+
+    # Long enough to have hit the walls, so the nose touch sensors are covered too
+    assert touched
@@ -0,0 +1,61 @@
+"""
+Optional features (probes, tracing, profiling, timing) wrap the nematode's methods through one hooks.Hooks,
+    so they can be started and stopped in any order without losing each other's wrappers.
+
+    python -m pytest test_hooks.py
+"""
+import contextlib
+import io
+
+import pytest
+
+from connectome import Nematode
+from kinematics import HeadlessBody
+from recorder import TraceReader
+from test_engines import step
+
+WRAPPED = ("propagate_connectome", "motorcontrol", "stimulate", "trigger_food_sensors", "trigger_nose_touch_sensors")
+
+
+def methods(nematode):
+    return {name: nematode.__dict__.get(name) for name in WRAPPED}
+
+
+@pytest.mark.parametrize("engine", ["dict", "csr"])
+def test_features_stop_in_any_order(engine, tmp_path):
+    nematode = Nematode(engine=engine, body=HeadlessBody())
+    plain = methods(nematode)
+    hits = []
+    probe = nematode.add_probe("AVAL", hits.append, start=10 ** 9)
+    nematode.start_trace(tmp_path / "run.trace")
+    profiler = nematode.start_profile()
+    timer = nematode.start_timing()
+    # Not the reverse of the order they started in, which used to drop the trace's wrapper
+    nematode.remove_probe(probe)
+
+    for _ in range(300):
+        step(nematode)
+
+    assert nematode.stop_profile() is profiler
+    with contextlib.redirect_stderr(io.StringIO()):
+        nematode.stop_timing()
+    nematode.stop_trace()
+    assert len(TraceReader(tmp_path / "run.trace")) == 300
+    assert profiler.steps == 300
+    assert timer.phase("propagate").calls == 300
+    assert not hits
+
+    assert methods(nematode) == plain
+    assert nematode.hooks.chains == {}
+    assert "move" not in nematode.body.__dict__
+    assert "food_sensed" not in nematode.environment.__dict__
+
+
+def test_unknown_probe_neuron_changes_nothing():
+    nematode = Nematode(engine="csr", body=HeadlessBody())
+    plain = methods(nematode)
+    with pytest.raises(KeyError):
+        nematode.add_probe("NOPE", print)
+    assert getattr(nematode, "probes", None) is None
+    assert methods(nematode) == plain
+    assert nematode.hooks.chains == {}
@@ -0,0 +1,65 @@
+"""
+Nematode.main paced by a RealtimeScheduler on a fake clock, so no time passes: with substeps, the brain steps
+    every timestep but the body only moves once a tick, by the sum of the tick's motor totals.
+
+    python -m pytest test_scheduler.py
+"""
+import pytest
+
+from connectome import Nematode
+from kinematics import HeadlessBody
+from scheduler import RealtimeScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class CountingBody(HeadlessBody):
+    def __init__(self):
+        super().__init__()
+        self.moves = []
+
+    def move(self, left, right):
+        self.moves.append((left, right))
+        return super().move(left, right)
+
+
+@pytest.mark.parametrize("engine", ["dict", "active"])
+@pytest.mark.parametrize("substeps", [1, 4])
+def test_body_moves_once_a_tick(engine, substeps):
+    ticks = 50
+    clock = FakeClock()
+    nematode = Nematode(engine=engine, body=CountingBody())
+    nematode.scheduler = RealtimeScheduler(10, substeps, clock=clock, sleep=clock.sleep)
+
+    # What motorcontrol read every step, which the body should get the sums of
+    motors = []
+
+    def recorded(motorcontrol):
+        def motorcontrol_recorded():
+            motorcontrol()
+            motors.append((nematode.accumleft, nematode.accumright))
+        return motorcontrol_recorded
+
+    nematode.hooks.add("test", nematode, "motorcontrol", recorded)
+    nematode.main(steps=ticks * substeps)
+
+    assert len(motors) == ticks * substeps
+    sums = [tuple(map(sum, zip(*motors[i:i + substeps]))) for i in range(0, len(motors), substeps)]
+    assert nematode.body.moves == sums
+    assert nematode.scheduler.ticks == ticks
+    # Each tick does no work on the fake clock, so sleeps a whole period
+    assert clock.sleeps == [pytest.approx(0.1)] * ticks
+    # main takes its substeps wrapper off the body when done
+    nematode.hooks.remove("test")
+    assert nematode.hooks.chains == {}
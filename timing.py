@@ -0,0 +1,123 @@
+"""
+Where the time goes in Nematode.main, phase by phase.
+
+PhaseTimer.wrap(phase, f) gives a version of f that charges the time spent in it to phase.
+Wrapped calls can nest, e.g. body.move inside motorcontrol inside propagate_connectome, and each phase
+    is only charged for its own time, not that of the phases called within it.
+Whatever isn't in any phase (the loop itself, tqdm, sleeping) is reported as "other".
+
+For each phase we keep a histogram of call times over all calls, in power of 2 buckets of ns,
+    and the last `window` call times, for a rolling view of the recent ones.
+"""
+import collections
+import time
+
+import numpy as np
+
+# What kind of time each phase is, to tell whether a run is brain, body or render bound
+GROUPS = {
+    "sense": "body",
+    "move": "body",
+    "stimulus": "brain",
+    "propagate": "brain",
+    "motor": "brain",
+    "render": "render",
+    "other": "loop",
+}
+
+
+class Phase:
+    def __init__(self, window):
+        self.calls = 0
+        self.total = 0
+        # buckets[b] counts calls that took [2**(b-1), 2**b) ns
+        self.buckets = [0] * 64
+        self.recent = collections.deque(maxlen=window)
+
+    def add(self, ns):
+        self.calls += 1
+        self.total += ns
+        self.buckets[ns.bit_length()] += 1
+        self.recent.append(ns)
+
+    def percentile(self, q):
+        """All-time percentile q (0-100) in ns, interpolated within the power of 2 bucket it falls in."""
+        if not self.calls:
+            return 0
+        cumulative = np.cumsum(self.buckets)
+        target = q / 100 * self.calls
+        b = int(np.searchsorted(cumulative, target))
+        below = cumulative[b - 1] if b else 0
+        low = 2 ** (b - 1) if b else 0
+        return low + (target - below) / self.buckets[b] * (2 ** b - low)
+
+
+class PhaseTimer:
+    def __init__(self, window=10000, clock=time.perf_counter_ns):
+        self.window = window
+        self.clock = clock
+        self.phases = {}
+        # [phase, ns charged so far] of each wrapped call in progress, innermost last
+        self.stack = []
+        self.mark = None
+        self.started = clock()
+
+    def phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = Phase(self.window)
+        return self.phases[name]
+
+    def enter(self, name):
+        now = self.clock()
+        if self.stack:
+            self.stack[-1][1] += now - self.mark
+        self.stack.append([name, 0])
+        self.mark = now
+
+    def exit(self):
+        now = self.clock()
+        name, ns = self.stack.pop()
+        self.phase(name).add(ns + now - self.mark)
+        self.mark = now
+
+    def wrap(self, name, f):
+        enter, exit = self.enter, self.exit
+
+        def timed(*args, **kwargs):
+            enter(name)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                exit()
+        return timed
+
+    def report(self, rolling=False):
+        """
+        A table of each phase's share of the wall time so far, call counts and call times, and what the
+            run is bound by. With rolling, the call times are percentiles of just the last window calls.
+        """
+        wall = self.clock() - self.started
+        totals = {name: phase.total for name, phase in self.phases.items()}
+        totals["other"] = max(wall - sum(totals.values()), 0)
+
+        lines = [f"{'phase':<10} {'calls':>10} {'total s':>9} {'wall':>6} {'mean us':>9} {'p50 us':>9} {'p99 us':>9}"
+                 + ("  (last %d calls)" % self.window if rolling else "")]
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]):
+            phase = self.phases.get(name)
+            if phase is None:
+                lines.append(f"{name:<10} {'':>10} {total / 1e9:>9.2f} {total / max(wall, 1):>6.1%}")
+                continue
+            if rolling and phase.recent:
+                p50, p99 = np.percentile(phase.recent, [50, 99])
+            else:
+                p50, p99 = phase.percentile(50), phase.percentile(99)
+            lines.append(f"{name:<10} {phase.calls:>10} {total / 1e9:>9.2f} {total / max(wall, 1):>6.1%}"
+                         f" {total / max(phase.calls, 1) / 1e3:>9.1f} {p50 / 1e3:>9.1f} {p99 / 1e3:>9.1f}")
+
+        groups = collections.Counter()
+        for name, total in totals.items():
+            groups[GROUPS.get(name, name)] += total
+        bound, total = groups.most_common(1)[0]
+        lines.append(f"{bound} bound: {total / max(wall, 1):.0%} of {wall / 1e9:.1f}s, "
+                     + ", ".join(f"{group} {t / max(wall, 1):.0%}" for group, t in groups.most_common()))
+        return "\n".join(lines)
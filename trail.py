@@ -0,0 +1,185 @@
+"""
+The body's trail as a few canvas polylines, instead of a canvas line per move.
+
+Drawing with turtle's pen makes a canvas item per forward(), and Tk slows down with every one of them,
+    which is why main() used to clear the drawing every 6000 steps. A Trail keeps the points itself:
+    the newest ones in an open run, one polyline whose coordinates are replaced in one call on each draw(),
+    and every chunk points it's simplified with Douglas-Peucker and sealed onto the end of a sealed run,
+    one polyline per stretch of one colour. add() only keeps the points, the canvas is only touched in draw().
+A polyline can't skip over the stretches of other colours in between, so each stretch needs its own,
+    but no more than that: the sealed runs are a ring of at most max_runs polylines, of about capacity points
+    in all, which trims the oldest run's head (or deletes it) to stay within both.
+
+So a draw() costs about the points added since the last one, however long the run has gone,
+    and the canvas never holds more than max_runs + 1 polylines, of about capacity points.
+"""
+import collections
+
+import numpy as np
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Which of points ((n, 2) array) to keep so that the polyline through the kept ones is never more than
+        tolerance from any dropped one. The first and last are always kept.
+
+    :return: boolean mask over points
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        start, end = points[a], points[b]
+        between = points[a + 1:b]
+        d = end - start
+        length = np.hypot(*d)
+        if length == 0:
+            dist = np.hypot(*(between - start).T)
+        else:
+            # Distance from the line through start and end
+            dist = np.abs(d[0] * (between[:, 1] - start[1]) - d[1] * (between[:, 0] - start[0])) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            keep[a + 1 + i] = True
+            stack.append((a, a + 1 + i))
+            stack.append((a + 1 + i, b))
+    return keep
+
+
+class Trail:
+    """
+    A path drawn on a Tk canvas (e.g. turtle.getcanvas()), a point at a time with add(), shown on draw().
+
+    :param capacity: about how many points of sealed runs to keep on the canvas
+    :param chunk: how many points the open run takes before it's sealed
+    :param tolerance: how far (in canvas units) Douglas-Peucker may move the sealed runs' lines
+    :param max_runs: most sealed runs (so polylines) to keep, the oldest are deleted past it
+    """
+    def __init__(self, canvas, capacity=20000, chunk=256, tolerance=0.5, width=1, max_runs=64):
+        self.canvas = canvas
+        self.capacity = capacity
+        self.chunk = chunk
+        self.tolerance = tolerance
+        self.width = width
+        self.max_runs = max_runs
+
+        # The open run: its colour, flat canvas coordinates [x0, y0, x1, y1, ...], and its polyline once drawn
+        self.color = "black"
+        self.coords = []
+        self.item = None
+        # (coordinates, colour) of the runs ended by a colour change or lift() since the last draw(), to seal then
+        self.ended = collections.deque()
+        # [polyline, flat canvas coordinates] of each sealed run, oldest first
+        self.runs = collections.deque()
+        self.sealed_points = 0
+        # Whether the open run carries on from the newest sealed run, and so is sealed onto it
+        self.joined = False
+
+    def add(self, x, y, color=None):
+        """Extend the trail to turtle coordinates x, y, in color (that of the last point if None)."""
+        if color is not None and color != self.color:
+            # The next run starts from this one's last point
+            self.ended.append((self.coords, self.color))
+            self.coords = self.coords[-2:]
+            self.color = color
+        # Canvas y is down
+        self.coords += (x, -y)
+
+    def lift(self):
+        """Start the next add() afresh, without a line from the last point, like turtle's penup()."""
+        self.ended.append((self.coords, self.color))
+        self.coords = []
+
+    def seal(self, coords, color):
+        """
+        Simplify coords, a run in color, onto the end of the newest sealed run if it carries on from it,
+            or into a new one if not, which takes over the open run's polyline if it has one.
+        """
+        if len(coords) >= 4:
+            points = np.array(coords).reshape(-1, 2)
+            points = points[douglas_peucker(points, self.tolerance)].ravel().tolist()
+            if self.joined:
+                # The open run starts on the sealed one's last point
+                item, sealed = self.runs[-1]
+                sealed += points[2:]
+                self.canvas.coords(item, *sealed)
+                self.sealed_points += len(points) // 2 - 1
+                if self.item is not None:
+                    self.canvas.delete(self.item)
+            else:
+                if self.item is None:
+                    item = self.canvas.create_line(*points, fill=color, width=self.width)
+                else:
+                    item = self.item
+                    self.canvas.coords(item, *points)
+                self.runs.append([item, points])
+                self.sealed_points += len(points) // 2
+                self.joined = True
+            self.trim()
+        elif self.item is not None:
+            self.canvas.delete(self.item)
+        self.item = None
+
+    def trim(self):
+        """
+        Delete the oldest runs past max_runs, and once there are more than capacity points, the oldest points
+            down to capacity - chunk, so that we only trim every so often.
+        """
+        runs = self.runs
+        while len(runs) > self.max_runs:
+            item, sealed = runs.popleft()
+            self.canvas.delete(item)
+            self.sealed_points -= len(sealed) // 2
+        if self.sealed_points <= self.capacity:
+            return
+        excess = self.sealed_points - max(self.capacity - self.chunk, 0)
+        while excess > 0 and runs:
+            item, sealed = runs[0]
+            if len(sealed) // 2 - excess >= 2:
+                # Cut the run's head off
+                del sealed[:2 * excess]
+                self.canvas.coords(item, *sealed)
+                self.sealed_points -= excess
+                break
+            runs.popleft()
+            self.canvas.delete(item)
+            self.sealed_points -= len(sealed) // 2
+            excess -= len(sealed) // 2
+        if not runs:
+            self.joined = False
+
+    def draw(self):
+        """Seal the runs ended since the last draw and the open run's full chunks, and bring its polyline up to date."""
+        while self.ended:
+            coords, color = self.ended.popleft()
+            self.seal(coords, color)
+            # Whatever comes next is a new stretch
+            self.joined = False
+        step = 2 * self.chunk
+        while len(self.coords) > step:
+            self.seal(self.coords[:step], self.color)
+            self.coords = self.coords[step - 2:]
+
+        if len(self.coords) < 4:
+            return
+        if self.item is None:
+            self.item = self.canvas.create_line(*self.coords, fill=self.color, width=self.width)
+        else:
+            self.canvas.coords(self.item, *self.coords)
+
+    def clear(self):
+        """Delete all of the trail but where it's at, like turtle's clear()."""
+        for item, sealed in self.runs:
+            self.canvas.delete(item)
+        self.runs.clear()
+        self.ended.clear()
+        self.sealed_points = 0
+        self.joined = False
+        if self.item is not None:
+            self.canvas.delete(self.item)
+            self.item = None
+        self.coords = self.coords[-2:]
@@ -0,0 +1,190 @@
+"""
+Pictures of where worms went, without a display.
+
+render(path, x, y, state) draws poses, for one worm (arrays of T poses) or a batch of them ((T, n_worms) arrays,
+    as stacked up from a kinematics.BodyBatch), to an SVG or PNG, by path's extension. Each move is coloured
+    the way Nematode.main colours the pen: black when the nose touched a wall, red on food, blue otherwise.
+read_poses(path) gets those from a recorder.py trace or spike log.
+
+PNGs are rasterized all at once with numpy: every move is sampled about once a pixel along its length,
+    and all the samples of all the moves of all the worms are written into the image in one fancy index,
+    later moves over earlier ones. Then it's zlib compressed into a PNG by hand, so nothing but numpy is needed.
+
+    python trajectory.py run.spikes run.png
+"""
+import argparse
+import struct
+import zlib
+
+import numpy as np
+
+from kinematics import cw, ch
+from recorder import MAGIC, SPIKE_MAGIC, STIMULUS, TraceReader, SpikeReader
+from render import COLORS
+
+RGB = {"blue": (0, 0, 255), "red": (255, 0, 0), "black": (0, 0, 0)}
+CAGE_RGB = (160, 160, 160)
+
+
+def sensor_state(stimulus):
+    """
+    Index into render.COLORS of what main() set the pen to, from a trace or spike log's stimulus bits.
+    Nose touch wins over food, as in main().
+    """
+    stimulus = np.asarray(stimulus)
+    return np.where(stimulus & STIMULUS["nose_touch_sensors"], 2,
+                    np.where(stimulus & STIMULUS["food_sensors"], 1, 0)).astype(np.uint8)
+
+
+def read_poses(path, compiled=None):
+    """
+    :return: (x, y, state) arrays of the body's position after each step of a trace or spike log,
+        and the sensor_state() of each step. Spike logs only keep the motor values, so their poses are
+        replayed from each keyframe's pose with a HeadlessBody, see recorder.Replay.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        columns = TraceReader(path).read(["x", "y", "stimulus"])
+        return columns["x"], columns["y"], sensor_state(columns["stimulus"])
+    if magic != SPIKE_MAGIC:
+        raise ValueError(f"{path} is neither a trace nor a spike log")
+
+    from kinematics import HeadlessBody
+    if compiled is None:
+        from engine import CompiledConnectome
+        compiled = CompiledConnectome.load()
+    log = SpikeReader(path, compiled)
+    xs, ys, states = [], [], []
+    for i in range(len(log.index)):
+        chunk = log.read_chunk(i)
+        rows = len(chunk["timestep"])
+        x, y = np.full(rows, np.nan), np.full(rows, np.nan)
+        if chunk["pose"] is not None:
+            body = HeadlessBody()
+            body.restore(chunk["pose"])
+            for j, (left, right) in enumerate(zip(chunk["accumleft"].tolist(), chunk["accumright"].tolist())):
+                body.move(left, right)
+                x[j], y[j] = body.x, body.y
+        xs.append(x)
+        ys.append(y)
+        states.append(sensor_state(chunk["stimulus"]))
+    return np.concatenate(xs), np.concatenate(ys), np.concatenate(states)
+
+
+def _moves(x, y, state, by_worm=False):
+    """
+    Every move of every worm as (x0, y0, x1, y1, state), without ones to or from nan,
+        in time order, or worm by worm with by_worm.
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if x.ndim == 1:
+        x, y = x[:, None], y[:, None]
+    state = np.zeros(x.shape, dtype=np.uint8) if state is None else np.asarray(state).reshape(x.shape)
+    if by_worm:
+        x, y, state = x.T, y.T, state.T
+        moves = [x[:, :-1].ravel(), y[:, :-1].ravel(), x[:, 1:].ravel(), y[:, 1:].ravel(), state[:, 1:].ravel()]
+    else:
+        moves = [x[:-1].ravel(), y[:-1].ravel(), x[1:].ravel(), y[1:].ravel(), state[1:].ravel()]
+    keep = np.isfinite(moves[0]) & np.isfinite(moves[1]) & np.isfinite(moves[2]) & np.isfinite(moves[3])
+    return [m[keep] for m in moves]
+
+
+def rasterize(x, y, state=None, size=800):
+    """The moves of x, y drawn onto a size by size RGB image of the cage, as a (size, size, 3) uint8 array."""
+    image = np.full((size, size, 3), 255, dtype=np.uint8)
+    image[[0, -1], :] = CAGE_RGB
+    image[:, [0, -1]] = CAGE_RGB
+
+    x0, y0, x1, y1, s = _moves(x, y, state)
+    # Cage to pixel coordinates, y down
+    scale = (size - 1) / (2 * cw)
+    x0, x1 = (x0 + cw) * scale, (x1 + cw) * scale
+    y0, y1 = (ch - y0) * (size - 1) / (2 * ch), (ch - y1) * (size - 1) / (2 * ch)
+
+    # n samples along each move, from its start to its end
+    n = np.ceil(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))).astype(np.int64) + 1
+    move = np.repeat(np.arange(len(n)), n)
+    f = (np.arange(len(move)) - np.repeat(np.cumsum(n) - n, n)) / np.maximum(n - 1, 1)[move]
+    px = np.clip(np.rint(x0[move] + (x1 - x0)[move] * f), 0, size - 1).astype(np.int64)
+    py = np.clip(np.rint(y0[move] + (y1 - y0)[move] * f), 0, size - 1).astype(np.int64)
+
+    # Later moves draw over earlier ones. Fancy indexing doesn't promise which of repeated pixels is written
+    #   last, so keep just the last sample of each pixel
+    pixel = (py * size + px)[::-1]
+    pixel, last = np.unique(pixel, return_index=True)
+    palette = np.array([RGB[color] for color in COLORS], dtype=np.uint8)
+    image.reshape(-1, 3)[pixel] = palette[s[move][::-1][last]]
+    return image
+
+
+def write_png(path, image, level=6):
+    """Write a (height, width, 3) uint8 RGB image as a PNG."""
+    height, width, _ = image.shape
+    # Each scanline starts with its filter type, 0 for none
+    raw = np.zeros((height, 1 + 3 * width), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), level)))
+        f.write(chunk(b"IEND", b""))
+
+
+def write_svg(path, x, y, state=None, size=800, stroke=1):
+    """
+    The moves of x, y as an SVG of the cage, size pixels across, in cage coordinates, with stroke pixel wide lines.
+    Each colour is one path, with a subpath per run of moves of that colour.
+    """
+    x0, y0, x1, y1, s = _moves(x, y, state, by_worm=True)
+    stroke = stroke * 2 * cw / size
+    # A run carries on while each move starts where the last ended with the same colour
+    new = np.ones(len(s), dtype=bool)
+    new[1:] = (s[1:] != s[:-1]) | (x0[1:] != x1[:-1]) | (y0[1:] != y1[:-1])
+    starts = np.flatnonzero(new)
+    ends = np.r_[starts[1:], len(s)]
+
+    start_points = np.char.add(np.char.add(np.char.mod("M%.2f,", x0[starts]), np.char.mod("%.2f", -y0[starts])), " L")
+    points = np.char.add(np.char.mod(" %.2f,", x1), np.char.mod("%.2f", -y1))
+    paths = {color: [] for color in range(len(COLORS))}
+    for a, b, first in zip(starts.tolist(), ends.tolist(), start_points.tolist()):
+        paths[int(s[a])].append(first + "".join(points[a:b].tolist()))
+
+    with open(path, "w") as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size * ch // cw}" '
+                f'viewBox="{-cw} {-ch} {2 * cw} {2 * ch}">\n')
+        f.write(f'<rect x="{-cw}" y="{-ch}" width="{2 * cw}" height="{2 * ch}" fill="white" '
+                f'stroke="rgb{CAGE_RGB}" stroke-width="{3 * stroke}"/>\n')
+        for color, subpaths in paths.items():
+            if subpaths:
+                f.write(f'<path fill="none" stroke="{COLORS[color]}" stroke-width="{stroke}" '
+                        f'd="{" ".join(subpaths)}"/>\n')
+        f.write("</svg>\n")
+
+
+def render(path, x, y, state=None, size=800):
+    """
+    Draw x, y (T poses, or (T, n_worms) of them) to path, an .svg or .png.
+    :param state: index into render.COLORS of each pose's move (see sensor_state), the same shape as x. All blue if None.
+    """
+    if str(path).endswith(".svg"):
+        write_svg(path, x, y, state, size)
+    else:
+        write_png(path, rasterize(x, y, state, size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draw the path of a trace or spike log")
+    parser.add_argument("recording", help="Trace or spike log, see recorder.py")
+    parser.add_argument("out", help="Where to draw it, .svg or .png")
+    parser.add_argument("--size", type=int, default=800, help="Image width in pixels")
+    args = parser.parse_args()
+    render(args.out, *read_poses(args.recording), size=args.size)
+
+
+if __name__ == '__main__':
+    main()